@@ -0,0 +1,262 @@
+"""
+    Benchmark of the load -> segment -> extract pipeline on synthetic EPD recordings.
+
+    A synthetic dataset shaped like the recording of `example/pipeline_example.out` (128 channels, 2528256 samples at
+    1024 Hz, 210 trials) is written to disk, then every stage of the pipeline is timed. Wall time, throughput and memory
+    usage (RSS) of each stage are written as JSON, so runs (e.g. before & after a change) can be compared:
+
+        python benchmarks/benchmark_pipeline.py --output before.json
+        python benchmarks/benchmark_pipeline.py --output after.json --compare before.json
+
+    Use --chan-nr/--samp-nr/--trial-nr for smaller (or larger) datasets.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import mne
+import braindynamics_plus as bdp
+
+# CONSTANTS
+TRIAL_START_CODE = [129] # stimulus ON
+TRIAL_END_CODE = [1, 2, 3] # key presses
+NEW_TRIAL_END_CODE = 515 # code of the added event markers (as in the example)
+EVENT_DESCRIPTION_DICT = {
+    "251": "Start block",
+    "128": "Fixation dot (red)",
+    "150": "Blank screen",
+    "129": "Stimulus ON",
+    "1": "Key press: 'L' - certain",
+    "2": "Key press: 'S' - uncertain",
+    "3": "Key press: 'A' - nothing",
+    "252": "End block",
+    "255": "End experiment",
+    str(NEW_TRIAL_END_CODE): "Stimulus ON + 0.5s",
+}
+
+def write_synthetic_epd(root_dir:str, subject_name:str, chan_nr:int=128, samp_nr:int=2528256, samp_freq:float=1024.0, trial_nr:int=210, seed:int=0) -> str:
+    """ Write a synthetic recording in EPD format (header, channel & event binaries).
+
+    Each trial consists of a fixation dot, a blank screen, the stimulus and a key press 1-6 seconds after the stimulus,
+    trials are spread evenly over the recording and enclosed by block start/end markers.
+
+    Args:
+        root_dir: dataset root directory (the recording is written into `root_dir/subject_name/`)
+        subject_name: name of the subject
+        chan_nr: number of channels. Defaults to 128.
+        samp_nr: number of samples. Defaults to 2528256.
+        samp_freq: sampling frequency in Hz. Defaults to 1024.0.
+        trial_nr: number of trials. Defaults to 210.
+        seed: seed of the random generator. Defaults to 0.
+
+    Returns:
+        path to the .epd file
+    """
+    rng = np.random.default_rng(seed)
+    subject_dir = os.path.join(root_dir, subject_name)
+    os.makedirs(subject_dir, exist_ok=True)
+
+    chan_fname_list = []
+    for chan_idx in range(chan_nr): # channel by channel, so the whole recording is never in memory
+        chan_fname = f"{subject_name}_ch{chan_idx:03d}.bin"
+        samp_arr = rng.standard_normal(samp_nr, dtype=np.float32)
+        samp_arr *= 10.0 # uV
+        samp_arr.tofile(os.path.join(subject_dir, chan_fname))
+        chan_fname_list.append(chan_fname)
+
+    trial_len = samp_nr//(trial_nr + 1)
+    trial_start_arr = np.arange(trial_nr, dtype=np.int64)*trial_len + trial_len//2
+    fixation_arr = trial_start_arr
+    blank_arr = fixation_arr + rng.integers(int(0.2*samp_freq), int(0.5*samp_freq), trial_nr)
+    stimulus_arr = blank_arr + rng.integers(int(0.2*samp_freq), int(0.5*samp_freq), trial_nr)
+    response_arr = np.minimum(stimulus_arr + rng.integers(int(1.0*samp_freq), int(6.0*samp_freq), trial_nr), trial_start_arr + trial_len - 1)
+    event_time_arr = np.concatenate(([0], fixation_arr, blank_arr, stimulus_arr, response_arr, [samp_nr - 2, samp_nr - 1]))
+    event_code_arr = np.concatenate(([251], np.full(trial_nr, 128), np.full(trial_nr, 150), np.full(trial_nr, 129), rng.integers(1, 4, trial_nr), [252, 255]))
+    order_arr = np.lexsort((event_code_arr, event_time_arr))
+    event_time_arr.astype(np.int32)[order_arr].tofile(os.path.join(subject_dir, f"{subject_name}_event_times.bin"))
+    event_code_arr.astype(np.int32)[order_arr].tofile(os.path.join(subject_dir, f"{subject_name}_event_codes.bin"))
+
+    line_list = ["# Synthetic EPD recording", "# Format version:", "1.1",
+                 "#", "# Number of channels:", str(chan_nr),
+                 "#", "# Sampling frequency (Hz):", str(samp_freq),
+                 "#", "# Number of samples:", str(samp_nr),
+                 "#", "# Channel sample files (32 bit float):"] + chan_fname_list + [
+                 "#", "# Event timestamps file (32 bit int):", f"{subject_name}_event_times.bin",
+                 "#", "# Event codes file (32 bit int):", f"{subject_name}_event_codes.bin",
+                 "#", "# Number of events:", str(len(event_time_arr)),
+                 "#", "# Channel names:"] + [f"E{chan_idx + 1}" for chan_idx in range(chan_nr)]
+    epd_file_path = os.path.join(subject_dir, f"{subject_name}.epd")
+    with open(epd_file_path, "w") as epd_file:
+        epd_file.write("\n".join(line_list) + "\n")
+    return epd_file_path
+
+def _rss_mb() -> float:
+    # current resident set size
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/2**20
+    except (OSError, ValueError):
+        return float("nan")
+
+def _reset_peak_rss() -> bool:
+    # reset the peak resident set size (Linux only), so the peak of a single stage can be measured
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs_file:
+            clear_refs_file.write("5")
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb() -> float:
+    # peak resident set size since the last reset (VmHWM), or of the whole process if it cannot be read (KiB on Linux, bytes on macOS)
+    try:
+        with open("/proc/self/status", "r") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/2**10
+    except (OSError, ValueError):
+        pass
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss/2**20 if sys.platform == "darwin" else peak_rss/2**10
+
+def _copied_nbytes(arr_list) -> int:
+    # bytes of the arrays holding their own samples (views of the sample matrix or memory-maps are not copied)
+    return sum(arr.nbytes for arr in arr_list if isinstance(arr, np.ndarray) and arr.base is None)
+
+def _time_stage(result_list:list, stage:str, repeat_idx:int, func, byte_nr_func=None):
+    rss_before = _rss_mb()
+    peak_reset = _reset_peak_rss()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    byte_nr = byte_nr_func(result) if byte_nr_func is not None else 0
+    result_list.append({
+        "stage": stage,
+        "repeat": repeat_idx,
+        "seconds": seconds,
+        "bytes": byte_nr,
+        "throughput_mbps": byte_nr/seconds/1.0e6 if seconds > 0 else float("inf"),
+        "rss_before_mb": rss_before,
+        "rss_after_mb": _rss_mb(),
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_rss_scope": "stage" if peak_reset else "process",
+    })
+    return result
+
+def run_benchmark(epd_file_path:str, repeat_nr:int=3, mode:str="memory", workers:int=1, window_len:int=512) -> list[dict]:
+    """ Time every stage of the pipeline on a recording.
+
+    Args:
+        epd_file_path: path to .epd file
+        repeat_nr: number of repetitions. Defaults to 3.
+        mode: sample loading mode, see `braindynamics_plus.load_epd_samples`. Defaults to "memory".
+        workers: number of threads reading channel binaries. Defaults to 1.
+        window_len: length of windows after the stimuli for `get_event_samples` and of the added trials. Defaults to 512.
+
+    Returns:
+        list of dictionaries (one per stage & repetition) with wall time, copied bytes (0 for stages returning views), throughput and RSS (peak of the stage where supported, see "peak_rss_scope")
+    """
+    result_list = []
+    for repeat_idx in range(repeat_nr):
+        data = bdp.BrainData()
+        _time_stage(result_list, "load_epd_header", repeat_idx, lambda: bdp.load_epd_header(data, epd_file_path),
+                    lambda _: 2*data.event_time_arr.nbytes)
+        _time_stage(result_list, "load_epd_samples", repeat_idx, lambda: bdp.load_epd_samples(data, mode=mode, workers=workers),
+                    lambda stat_dict: stat_dict["bytes"])
+        data.set_event_descriptions(EVENT_DESCRIPTION_DICT)
+
+        stimulus_time_arr = np.asarray(data.event_time_arr)[np.isin(data.event_code_arr, TRIAL_START_CODE)]
+        _time_stage(result_list, "add_events", repeat_idx, lambda: data.add_events(stimulus_time_arr + window_len, np.full(len(stimulus_time_arr), NEW_TRIAL_END_CODE, dtype=np.int32)),
+                    lambda _: 2*np.asarray(data.event_time_arr).nbytes)
+        _time_stage(result_list, "divide_into_trials", repeat_idx, lambda: data.divide_into_trials(TRIAL_START_CODE, TRIAL_END_CODE),
+                    lambda _: 2*np.asarray(data.event_time_arr).nbytes)
+        _time_stage(result_list, "get_trial_samples", repeat_idx, lambda: data.get_trial_samples(),
+                    _copied_nbytes)
+        _time_stage(result_list, "get_trial_samples_packed", repeat_idx, lambda: data.get_trial_samples(layout="packed"),
+                    lambda packed: packed.buffer.nbytes)
+        _time_stage(result_list, "get_event_samples", repeat_idx, lambda: data.get_event_samples(TRIAL_START_CODE[0], window_len),
+                    _copied_nbytes)
+        _time_stage(result_list, "convert_to_mne_raw", repeat_idx, lambda: data.convert_to_mne_raw(),
+                    lambda raw: raw.get_data().nbytes)
+        del data
+    return result_list
+
+def summarize(result_list:list[dict]) -> dict:
+    """ Best (minimal) wall time and maximal peak RSS of each stage over the repetitions.
+    """
+    summary_dict = {}
+    for result_dict in result_list:
+        stage_dict = summary_dict.setdefault(result_dict["stage"], {"best_seconds": float("inf"), "best_throughput_mbps": 0.0, "peak_rss_mb": 0.0})
+        stage_dict["best_seconds"] = min(stage_dict["best_seconds"], result_dict["seconds"])
+        stage_dict["best_throughput_mbps"] = max(stage_dict["best_throughput_mbps"], result_dict["throughput_mbps"])
+        stage_dict["peak_rss_mb"] = max(stage_dict["peak_rss_mb"], result_dict["peak_rss_mb"])
+    return summary_dict
+
+def compare(summary_dict:dict, baseline_summary_dict:dict) -> dict:
+    """ Speedup (baseline time / current time) of every stage present in both summaries.
+    """
+    return {stage: baseline_summary_dict[stage]["best_seconds"]/stage_dict["best_seconds"]
+            for stage, stage_dict in summary_dict.items() if stage in baseline_summary_dict and stage_dict["best_seconds"] > 0}
+
+def main(argv:list[str]=None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the load -> segment -> extract pipeline on synthetic EPD data.")
+    parser.add_argument("--chan-nr", type=int, default=128, help="number of channels (default: 128)")
+    parser.add_argument("--samp-nr", type=int, default=2528256, help="number of samples (default: 2528256)")
+    parser.add_argument("--samp-freq", type=float, default=1024.0, help="sampling frequency in Hz (default: 1024)")
+    parser.add_argument("--trial-nr", type=int, default=210, help="number of trials, i.e. event density (default: 210)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of repetitions (default: 3)")
+    parser.add_argument("--mode", default="memory", help="sample loading mode (default: memory)")
+    parser.add_argument("--workers", type=int, default=1, help="number of threads reading channel binaries (default: 1)")
+    parser.add_argument("--data-dir", default=None, help="directory of the synthetic dataset (reused if it exists; default: temporary directory)")
+    parser.add_argument("--output", default=None, help="path of the JSON results (default: standard output)")
+    parser.add_argument("--compare", default=None, help="path of previous JSON results to compare with")
+    args = parser.parse_args(argv)
+    mne.set_log_level("WARNING") # keep standard output machine-readable
+
+    data_dir = args.data_dir if args.data_dir is not None else tempfile.mkdtemp(prefix="bdp_benchmark_")
+    subject_name = f"synthetic_{args.chan_nr}x{args.samp_nr}_{args.trial_nr}"
+    epd_file_path = os.path.join(data_dir, subject_name, f"{subject_name}.epd")
+    try:
+        if not os.path.exists(epd_file_path):
+            write_synthetic_epd(data_dir, subject_name, chan_nr=args.chan_nr, samp_nr=args.samp_nr, samp_freq=args.samp_freq, trial_nr=args.trial_nr)
+        result_list = run_benchmark(epd_file_path, repeat_nr=args.repeat, mode=args.mode, workers=args.workers)
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report_dict = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "chan_nr": args.chan_nr,
+            "samp_nr": args.samp_nr,
+            "samp_freq": args.samp_freq,
+            "trial_nr": args.trial_nr,
+            "mode": args.mode,
+            "workers": args.workers,
+        },
+        "results": result_list,
+        "summary": summarize(result_list),
+    }
+    if args.compare is not None:
+        with open(args.compare, "r") as baseline_file:
+            report_dict["speedup"] = compare(report_dict["summary"], json.load(baseline_file)["summary"])
+
+    if args.output is None:
+        json.dump(report_dict, sys.stdout, indent=4)
+        print()
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report_dict, output_file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -46,12 +46,12 @@ trial_samples = trial_data.samp_mat_list
 ## NOTE: additional event markers can be added to the whole dataset
 ##       for example, I need only 0.5 second after `TRIAL_START_CODE`
 ##       code would look like the following:
-trial_start_indices = np.where(np.isin(data.event_code_arr, TRIAL_START_CODE))[0]
+trial_start_times = data.get_event_times(TRIAL_START_CODE)
 offset = int(0.5*data.samp_freq) # 0.5 seconds in sampling units
 new_trial_end_code = [515] # give any value you want, just make sure it's not already used; it should be list remember!
 if np.isin(new_trial_end_code, data.event_code_arr)[0]:
     raise Warning(f'Newly defined trial end code ({new_trial_end_code}) is already present in the original dataset!')
-data.add_events(data.event_time_arr[trial_start_indices] + offset, np.full(len(trial_start_indices), new_trial_end_code, dtype=np.int32))
+data.add_events(trial_start_times + offset, np.full(len(trial_start_times), new_trial_end_code, dtype=np.int32))
 trial_data = data.get_trial_brain_data(start_mark_list=TRIAL_START_CODE, end_mark_list=new_trial_end_code)
 print('> Adding new event markers to define trials..\n\n', trial_data, '\n')
 trial_samples = trial_data.samp_mat_list
@@ -1,2 +1,3 @@
 from .braindata import *
 from .io import *
+from .instrumentation import *
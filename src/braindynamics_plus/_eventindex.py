@@ -0,0 +1,83 @@
+import numpy as np
+
+class EventIndex:
+    """ Sorted array of event timestamps for every event code, answering time-range queries with binary search.
+
+    The stored arrays are read-only, since queries of a single code return views of them.
+    """
+
+    def __init__(self, event_time_arr:np.ndarray, event_code_arr:np.ndarray):
+        self.time_arr_dict = dict() # event code -> sorted array of its timestamps
+        self.insert(event_time_arr, event_code_arr)
+
+    def __str__(self) -> str:
+        return f"Index of {sum(len(time_arr) for time_arr in self.time_arr_dict.values())} events with {len(self.time_arr_dict)} codes."
+
+    def insert(self, event_time_arr:np.ndarray, event_code_arr:np.ndarray) -> None:
+        """ Add new events to the index.
+
+        Args:
+            event_time_arr: array of new event timestamps
+            event_code_arr: array of new event codes
+        """
+        event_time_arr = np.asarray(event_time_arr)
+        event_code_arr = np.asarray(event_code_arr)
+        if len(event_time_arr) != len(event_code_arr):
+            raise ValueError(f"Dimension mismatch between array of event timestamps ({len(event_time_arr)}) and codes ({len(event_code_arr)})")
+
+        order_arr = np.lexsort((event_time_arr, event_code_arr))
+        event_time_arr = event_time_arr[order_arr]
+        event_code_arr = event_code_arr[order_arr]
+        code_arr, first_idx_arr = np.unique(event_code_arr, return_index=True)
+        last_idx_arr = np.append(first_idx_arr[1:], len(event_code_arr))
+        for code, first, last in zip(code_arr.tolist(), first_idx_arr.tolist(), last_idx_arr.tolist()):
+            new_time_arr = event_time_arr[first:last]
+            if code in self.time_arr_dict:
+                time_arr = self.time_arr_dict[code]
+                time_arr = np.insert(time_arr, np.searchsorted(time_arr, new_time_arr, side="right"), new_time_arr)
+            else:
+                time_arr = new_time_arr.copy()
+            time_arr.flags.writeable = False
+            self.time_arr_dict[code] = time_arr
+
+    def _code_time_arr_list(self, event_codes) -> list:
+        return [self.time_arr_dict[code] for code in np.unique(event_codes).tolist() if code in self.time_arr_dict]
+
+    def get_times(self, event_codes, start_time:int=None, end_time:int=None) -> np.ndarray:
+        """ Timestamps of events with the given codes in the time range `[start_time, end_time)`.
+
+        Args:
+            event_codes: code or list of codes of the events of interest
+            start_time: start of the time range (inclusive). Defaults to None (beginning of the recording).
+            end_time: end of the time range (exclusive). Defaults to None (end of the recording).
+
+        Returns:
+            sorted array of timestamps (read-only view of the index for a single code)
+        """
+        range_arr_list = []
+        for time_arr in self._code_time_arr_list(event_codes):
+            first = 0 if start_time is None else np.searchsorted(time_arr, start_time, side="left")
+            last = len(time_arr) if end_time is None else np.searchsorted(time_arr, end_time, side="left")
+            range_arr_list.append(time_arr[first:last])
+        if len(range_arr_list) == 0:
+            return np.empty(0, dtype=np.int32)
+        if len(range_arr_list) == 1:
+            return range_arr_list[0]
+        return np.sort(np.concatenate(range_arr_list), kind="stable")
+
+    def get_next_time(self, event_codes, time:int):
+        """ Timestamp of the first event with the given codes strictly after `time`.
+
+        Args:
+            event_codes: code or list of codes of the events of interest
+            time: reference timestamp
+
+        Returns:
+            timestamp of the next event or None if there is no such event
+        """
+        next_time = None
+        for time_arr in self._code_time_arr_list(event_codes):
+            idx = np.searchsorted(time_arr, time, side="right")
+            if idx < len(time_arr) and (next_time is None or time_arr[idx] < next_time):
+                next_time = int(time_arr[idx])
+        return next_time
@@ -0,0 +1,127 @@
+import numpy as np
+from scipy import signal
+
+# CONSTANTS
+FILTER_TYPE_LIST = ("iir", "fir") # types of band-pass & anti-alias filters
+REREF_LIST = ("average",) # re-referencing schemes
+
+class _StreamingFilter:
+    """ Causal filter applied block by block along the sample axis of a (channel x sample) matrix, carrying its state across blocks.
+
+    Filtering the blocks of a recording one after the other gives the same result as filtering it at once. The state is
+    initialized to the steady state of the first sample of every channel (no onset transient for signals with offset).
+    """
+
+    def __init__(self, sos:np.ndarray=None, taps:np.ndarray=None):
+        if (sos is None) == (taps is None):
+            raise ValueError("Either second-order sections or FIR taps should be given")
+        self.sos = sos # second-order sections of an IIR filter
+        self.taps = taps # coefficients of an FIR filter
+        self.zi = None # filter state (initialized with the first block)
+
+    @property
+    def delay(self) -> float:
+        """ Group delay (in samples) of FIR filters (linear phase), None for IIR filters (frequency dependent). """
+        return (len(self.taps) - 1)/2 if self.taps is not None else None
+
+    def __call__(self, block:np.ndarray) -> np.ndarray:
+        if self.zi is None:
+            first_arr = block[:, 0] if block.shape[1] > 0 else np.zeros(block.shape[0])
+            if self.sos is not None:
+                self.zi = signal.sosfilt_zi(self.sos)[:, None, :]*first_arr[None, :, None]
+            else:
+                self.zi = signal.lfilter_zi(self.taps, 1.0)[None, :]*first_arr[:, None]
+        if self.sos is not None:
+            block, self.zi = signal.sosfilt(self.sos, block, axis=1, zi=self.zi)
+        else:
+            block, self.zi = signal.lfilter(self.taps, 1.0, block, axis=1, zi=self.zi)
+        return block
+
+def design_band_filter(samp_freq:float, band:tuple, filter_type:str="iir", order:int=None) -> _StreamingFilter:
+    """ Design a causal band-pass (or low-/high-pass) filter.
+
+    Args:
+        samp_freq: sampling frequency (Hz)
+        band: (low, high) cutoff frequencies in Hz, None for either of them gives a high-/low-pass filter
+        filter_type: "iir" (Butterworth, second-order sections) or "fir" (Hamming window, linear phase). Defaults to "iir".
+        order: filter order. Defaults to None, in which case 4 is used for IIR and 3 periods of the lowest cutoff for FIR filters.
+
+    Returns:
+        filter applicable block by block
+
+    Raises:
+        ValueError: invalid cutoff frequencies or filter type
+    """
+    if filter_type not in FILTER_TYPE_LIST:
+        raise ValueError(f"Unknown filter type: {filter_type}")
+    low, high = band
+    nyquist = samp_freq/2
+    if (low is None and high is None) or any(freq is not None and not 0 < freq < nyquist for freq in (low, high)) or (low is not None and high is not None and low >= high):
+        raise ValueError(f"Invalid band {band} for {samp_freq}Hz sampling frequency")
+    if low is None:
+        cutoff, btype = high, "lowpass"
+    elif high is None:
+        cutoff, btype = low, "highpass"
+    else:
+        cutoff, btype = [low, high], "bandpass"
+
+    if filter_type == "iir":
+        order = 4 if order is None else order
+        return _StreamingFilter(sos=signal.butter(order, cutoff, btype=btype, fs=samp_freq, output="sos"))
+    if order is None:
+        order = int(3*samp_freq/min(freq for freq in (low, high) if freq is not None))
+    order += order % 2 # odd number of taps (type I filter), required for high- & band-pass
+    return _StreamingFilter(taps=signal.firwin(order + 1, cutoff, pass_zero=btype, fs=samp_freq))
+
+def design_antialias_filter(decimate:int, filter_type:str="iir") -> _StreamingFilter:
+    """ Design the anti-alias low-pass filter preceding decimation (same as `scipy.signal.decimate`).
+
+    Args:
+        decimate: decimation factor
+        filter_type: "iir" (8th order Chebyshev type I, cutoff at 80% of the new Nyquist frequency) or "fir" (20*decimate + 1 taps, Hamming window). Defaults to "iir".
+
+    Returns:
+        filter applicable block by block
+    """
+    if filter_type not in FILTER_TYPE_LIST:
+        raise ValueError(f"Unknown filter type: {filter_type}")
+    if filter_type == "iir":
+        return _StreamingFilter(sos=signal.cheby1(8, 0.05, 0.8/decimate, output="sos"))
+    return _StreamingFilter(taps=signal.firwin(20*decimate + 1, 1.0/decimate, window="hamming"))
+
+def preprocess_samples(samp_mat, out:np.ndarray, reref:str=None, filter_list:list=(), decimate:int=1, block_len:int=65536) -> None:
+    """ Re-reference, filter & decimate a (channel x sample) matrix block by block.
+
+    Only one block of samples is held in (float64) working memory at a time. `out` may be `samp_mat` itself (in-place
+    processing), since every block is read before it (or anything before it) is written.
+
+    Args:
+        samp_mat: (channel x sample) matrix (numpy array, memory-map or `ChannelStack`/`ChannelFileReader`/`QuantizedSamples`)
+        out: (channel x ceil(sample/decimate)) array storing the result
+        reref: "average" subtracts the mean of the channels from every sample (common average reference). Defaults to None.
+        filter_list: filters applied one after the other, see `design_band_filter` & `design_antialias_filter`. Defaults to ().
+        decimate: keep every `decimate`-th sample (starting with the first one). Defaults to 1.
+        block_len: number of samples processed at once. Defaults to 65536.
+
+    Raises:
+        ValueError: unknown re-referencing; invalid block length, decimation factor or output shape
+    """
+    if reref is not None and reref not in REREF_LIST:
+        raise ValueError(f"Unknown re-referencing: {reref}")
+    if block_len <= 0 or decimate < 1:
+        raise ValueError(f"Block length and decimation factor should be positive, got {block_len} and {decimate}")
+    chan_nr, samp_nr = samp_mat.shape
+    out_shape = (chan_nr, -(-samp_nr//decimate))
+    if out.shape != out_shape:
+        raise ValueError(f"Shape of output array {out.shape} does not match {out_shape}")
+
+    for start in range(0, samp_nr, block_len):
+        end = min(start + block_len, samp_nr)
+        block = np.asarray(samp_mat[:, start:end], dtype=np.float64)
+        if reref == "average":
+            block = block - block.mean(axis=0)
+        for filt in filter_list:
+            block = filt(block)
+        first = -(-start//decimate) # first output sample of the block (keeping the decimation phase across blocks)
+        block = block[:, first*decimate - start::decimate]
+        out[:, first:first + block.shape[1]] = block
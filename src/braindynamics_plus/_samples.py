@@ -0,0 +1,272 @@
+import numpy as np
+import os
+from numpy.lib.mixins import NDArrayOperatorsMixin
+from .instrumentation import record_bytes_read
+
+# CONSTANTS
+QUANTIZED_DTYPE_LIST = ("int16", "float16") # compact storage types of samples
+_INT16_LEVEL_NR = 65534 # quantization levels used for int16 storage (-32767..32767)
+
+class _StackedSamples(NDArrayOperatorsMixin):
+    """ Read-only (channel x sample) matrix whose rows are fetched on demand.
+
+    Subclasses implement `_read_row`, indexing returns plain numpy arrays holding only the requested part. Rows and
+    columns can be indexed with integers, slices, boolean masks or index arrays (e.g. `samp_mat[:, t]` gives the samples
+    of every channel at time `t`).
+    """
+    ndim = 2
+
+    def __init__(self, chan_nr:int, samp_nr:int, dtype=np.float32):
+        self.shape = (chan_nr, samp_nr)
+        self.dtype = np.dtype(dtype)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(shape={self.shape}, dtype={self.dtype})"
+
+    @property
+    def size(self) -> int:
+        return self.shape[0]*self.shape[1]
+
+    def _read_row(self, row_idx:int, col_key):
+        raise NotImplementedError
+
+    def _read_row_into(self, row_idx:int, col_key, out:np.ndarray) -> None:
+        out[...] = self._read_row(row_idx, col_key)
+
+    def _col_shape(self, col_key) -> tuple:
+        if isinstance(col_key, slice):
+            return (len(range(*col_key.indices(self.shape[1]))),)
+        if isinstance(col_key, (int, np.integer)):
+            return ()
+        col_key = np.asarray(col_key)
+        if col_key.dtype == bool:
+            return (int(np.count_nonzero(col_key)),)
+        return col_key.shape
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError(f"Too many indices for 2D samples: {len(key)}")
+        row_key = key[0]
+        col_key = key[1] if len(key) == 2 else slice(None)
+
+        if isinstance(row_key, (int, np.integer)):
+            row_idx = int(row_key)
+            if not -self.shape[0] <= row_idx < self.shape[0]:
+                raise IndexError(f"Channel index {row_idx} out of range for {self.shape[0]} channels")
+            return self._read_row(row_idx % self.shape[0], col_key)
+
+        row_idx_arr = np.arange(self.shape[0])[row_key]
+        out = np.empty((len(row_idx_arr),) + self._col_shape(col_key), dtype=self.dtype)
+        for i, row_idx in enumerate(row_idx_arr):
+            self._read_row_into(int(row_idx), col_key, out[i, ...]) # view (also 0D for integer column keys)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        samp_mat = self.materialize()
+        return samp_mat if dtype is None else samp_mat.astype(dtype, copy=False)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, _StackedSamples) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def materialize(self) -> np.ndarray:
+        """ Read every sample into a regular in-memory matrix.
+
+        Returns:
+            numpy array of shape (chan_nr, samp_nr)
+        """
+        return self[:, :]
+
+class ChannelStack(_StackedSamples):
+    """ Channel-stacked view over per-channel 1D arrays (typically `np.memmap` of channel binaries).
+
+    Slicing only touches (and with memory-maps only pages in) the requested samples.
+    """
+
+    def __init__(self, chan_list:list, dtype=np.float32):
+        samp_nr = len(chan_list[0]) if len(chan_list) > 0 else 0
+        for chan in chan_list:
+            if len(chan) != samp_nr:
+                raise ValueError(f"Channel length mismatch ({len(chan)} instead of {samp_nr})")
+        super().__init__(len(chan_list), samp_nr, dtype=dtype)
+        self.chan_list = chan_list
+
+    @property
+    def nbytes(self) -> int:
+        return sum(chan.nbytes for chan in self.chan_list)
+
+    def _read_row(self, row_idx:int, col_key):
+        return self.chan_list[row_idx][col_key]
+
+class ChannelFileReader(_StackedSamples):
+    """ Channel-stacked view over per-channel binary files read with positioned reads (`os.preadv`).
+
+    Nothing is mapped or cached: slicing reads exactly the requested samples into a new array, so memory use is
+    proportional to the slice and not to the length of the recording.
+    """
+
+    def __init__(self, chan_file_path_list:list[str], samp_nr:int, dtype=np.float32):
+        super().__init__(len(chan_file_path_list), samp_nr, dtype=dtype)
+        self.chan_file_path_list = list(chan_file_path_list)
+        for chan_file_path in self.chan_file_path_list:
+            file_size = os.path.getsize(chan_file_path)
+            if file_size != samp_nr*self.dtype.itemsize:
+                raise ValueError(f"Size of {chan_file_path} ({file_size} bytes) does not match the number of samples ({samp_nr*self.dtype.itemsize} bytes)")
+        self._fd_list = [None]*len(self.chan_file_path_list)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_fd_list"] = [None]*len(self.chan_file_path_list)
+        return state
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def nbytes(self) -> int:
+        return 0 # nothing is held in memory
+
+    def close(self) -> None:
+        """ Close the open channel files (they are reopened on the next read). """
+        for i, fd in enumerate(getattr(self, "_fd_list", [])):
+            if fd is not None:
+                os.close(fd)
+                self._fd_list[i] = None
+
+    def _get_fd(self, row_idx:int) -> int:
+        if self._fd_list[row_idx] is None:
+            self._fd_list[row_idx] = os.open(self.chan_file_path_list[row_idx], os.O_RDONLY)
+        return self._fd_list[row_idx]
+
+    def _pread_into(self, row_idx:int, first:int, out:np.ndarray) -> None:
+        fd = self._get_fd(row_idx)
+        buffer = memoryview(out).cast("B")
+        offset = first*self.dtype.itemsize
+        read_nr = 0
+        while read_nr < len(buffer):
+            if hasattr(os, "preadv"):
+                chunk_nr = os.preadv(fd, [buffer[read_nr:]], offset + read_nr)
+            else:
+                chunk = os.pread(fd, len(buffer) - read_nr, offset + read_nr)
+                chunk_nr = len(chunk)
+                buffer[read_nr:read_nr + chunk_nr] = chunk
+            if chunk_nr == 0:
+                raise ValueError(f"Unexpected end of file in {self.chan_file_path_list[row_idx]}")
+            read_nr += chunk_nr
+        record_bytes_read(read_nr)
+
+    def _read_row(self, row_idx:int, col_key):
+        out = np.empty(self._col_shape(col_key), dtype=self.dtype)
+        self._read_row_into(row_idx, col_key, out)
+        return out
+
+    def _read_row_into(self, row_idx:int, col_key, out:np.ndarray) -> None:
+        if isinstance(col_key, slice) and col_key.step in (None, 1) and out.flags.c_contiguous:
+            first, last, _ = col_key.indices(self.shape[1])
+            if last > first:
+                self._pread_into(row_idx, first, out)
+            return
+        # any other indexing (stepped slices included): read the covered span, then index it
+        col_idx_arr = np.arange(*col_key.indices(self.shape[1])) if isinstance(col_key, slice) else np.asarray(col_key)
+        if col_idx_arr.dtype == bool:
+            col_idx_arr = np.flatnonzero(col_idx_arr)
+        col_idx_arr = np.where(col_idx_arr < 0, col_idx_arr + self.shape[1], col_idx_arr)
+        if col_idx_arr.size == 0:
+            return
+        if col_idx_arr.min() < 0 or col_idx_arr.max() >= self.shape[1]:
+            raise IndexError(f"Sample index out of range for {self.shape[1]} samples")
+        first, last = int(col_idx_arr.min()), int(col_idx_arr.max()) + 1
+        span = np.empty(last - first, dtype=self.dtype)
+        self._pread_into(row_idx, first, span)
+        out[...] = span[col_idx_arr - first]
+
+def quantize_row(row:np.ndarray, storage_dtype:str="int16") -> tuple:
+    """ Quantize samples of a channel.
+
+    int16: `x ~ q*scale + offset` with `scale = (max - min)/65534` and `offset = (max + min)/2`, so the error is at most
+    `scale/2` (plus float32 rounding). float16: `x ~ float16(x)`, relative error at most 2**-11 (values must be within +-65504).
+
+    Args:
+        row: samples of the channel
+        storage_dtype: "int16" or "float16". Defaults to "int16".
+
+    Returns:
+        tuple of the quantized samples, scale, offset and the maximal absolute error of the dequantized samples
+
+    Raises:
+        ValueError: unknown storage type; samples out of float16 range
+    """
+    if storage_dtype not in QUANTIZED_DTYPE_LIST:
+        raise ValueError(f"Unknown compact storage type: {storage_dtype}")
+    row64 = np.asarray(row, dtype=np.float64)
+    if storage_dtype == "int16":
+        low, high = (float(row64.min()), float(row64.max())) if len(row64) > 0 else (0.0, 0.0)
+        scale = np.float32((high - low)/_INT16_LEVEL_NR if high > low else 1.0)
+        offset = np.float32((high + low)/2)
+        quant_row = np.clip(np.rint((row64 - float(offset))/float(scale)), -_INT16_LEVEL_NR//2, _INT16_LEVEL_NR//2).astype(np.int16)
+        dequant_row = quant_row.astype(np.float32)
+        dequant_row *= scale
+        dequant_row += offset
+    else:
+        if len(row64) > 0 and np.abs(row64).max() > np.finfo(np.float16).max:
+            raise ValueError(f"Samples out of float16 range (+-{np.finfo(np.float16).max})")
+        scale, offset = np.float32(1.0), np.float32(0.0)
+        quant_row = np.asarray(row).astype(np.float16)
+        dequant_row = quant_row.astype(np.float32)
+    max_abs_error = float(np.abs(dequant_row - row64).max()) if len(row64) > 0 else 0.0
+    return quant_row, scale, offset, max_abs_error
+
+class QuantizedSamples(_StackedSamples):
+    """ (channel x sample) matrix stored compactly (int16 with per-channel scale & offset, or float16).
+
+    Slicing dequantizes only the requested samples into float32. `max_abs_error_arr` holds the maximal absolute error of
+    the dequantized samples of each channel (measured when quantizing).
+    """
+
+    def __init__(self, quant_mat:np.ndarray, scale_arr:np.ndarray, offset_arr:np.ndarray, max_abs_error_arr:np.ndarray, dtype=np.float32):
+        super().__init__(quant_mat.shape[0], quant_mat.shape[1], dtype=dtype)
+        self.quant_mat = quant_mat # matrix of quantized samples (numpy array or memory-map)
+        self.scale_arr = np.asarray(scale_arr, dtype=self.dtype)
+        self.offset_arr = np.asarray(offset_arr, dtype=self.dtype)
+        self.max_abs_error_arr = np.asarray(max_abs_error_arr, dtype=np.float64)
+        if len(self.scale_arr) != self.shape[0] or len(self.offset_arr) != self.shape[0] or len(self.max_abs_error_arr) != self.shape[0]:
+            raise ValueError("Scale, offset and error arrays should have one value per channel")
+
+    @classmethod
+    def quantize(cls, samp_mat, storage_dtype:str="int16") -> "QuantizedSamples":
+        """ Quantize a (channel x sample) matrix channel by channel, see `quantize_row`.
+        """
+        if storage_dtype not in QUANTIZED_DTYPE_LIST:
+            raise ValueError(f"Unknown compact storage type: {storage_dtype}")
+        chan_nr, samp_nr = samp_mat.shape
+        quant_mat = np.empty((chan_nr, samp_nr), dtype=storage_dtype)
+        scale_arr = np.empty(chan_nr, dtype=np.float32)
+        offset_arr = np.empty(chan_nr, dtype=np.float32)
+        max_abs_error_arr = np.empty(chan_nr, dtype=np.float64)
+        for chan_idx in range(chan_nr):
+            quant_mat[chan_idx], scale_arr[chan_idx], offset_arr[chan_idx], max_abs_error_arr[chan_idx] = quantize_row(samp_mat[chan_idx], storage_dtype)
+        return cls(quant_mat, scale_arr, offset_arr, max_abs_error_arr, dtype=samp_mat.dtype)
+
+    @property
+    def storage_dtype(self) -> np.dtype:
+        return self.quant_mat.dtype
+
+    @property
+    def nbytes(self) -> int:
+        return self.quant_mat.nbytes + self.scale_arr.nbytes + self.offset_arr.nbytes
+
+    def _read_row(self, row_idx:int, col_key):
+        out = np.empty(self._col_shape(col_key), dtype=self.dtype)
+        self._read_row_into(row_idx, col_key, out)
+        return out
+
+    def _read_row_into(self, row_idx:int, col_key, out:np.ndarray) -> None:
+        out[...] = self.quant_mat[row_idx, col_key]
+        if self.storage_dtype != np.float16:
+            out *= self.scale_arr[row_idx]
+            out += self.offset_arr[row_idx]
@@ -0,0 +1,85 @@
+import numpy as np
+
+def segment_trials(event_time_arr:np.ndarray, event_code_arr:np.ndarray, start_mark_list:list[int], end_mark_list:list[int]) -> tuple:
+    """ Vectorized division of the event timeline into trials.
+
+    Produces the same trials as the event-by-event walk of `BrainData.divide_into_trials`: a trial is closed by the first
+    end code of a group of simultaneous events (and also takes the rest of that group), it begins at the group of
+    simultaneous events containing the last start code seen since the previous trial (or right after the previous trial
+    if no start code occured), and its markers are the unique (timestamp, code) pairs in between, sorted.
+
+    Args:
+        event_time_arr: array of event timestamps
+        event_code_arr: array of event codes
+        start_mark_list: list of codes marking start of trial
+        end_mark_list: list of codes marking end of trial
+
+    Returns:
+        tuple of arrays `(start_time_arr, end_time_arr, end_code_arr, mark_offset_arr, mark_time_arr, mark_code_arr)`, where
+        markers of trial `i` are `mark_time_arr[mark_offset_arr[i]:mark_offset_arr[i+1]]` (and same for codes)
+
+    Raises:
+        ValueError: dimension mismatch between timestamp and code arrays
+    """
+    event_time_arr = np.asarray(event_time_arr)
+    event_code_arr = np.asarray(event_code_arr)
+    if len(event_time_arr) != len(event_code_arr):
+        raise ValueError(f"Dimension mismatch between array of event timestamps ({len(event_time_arr)}) and codes ({len(event_code_arr)})")
+    event_nr = len(event_time_arr)
+    time_dtype = event_time_arr.dtype
+    code_dtype = event_code_arr.dtype
+
+    # groups of consecutive events sharing the same timestamp
+    group_begin_mask = np.ones(event_nr, dtype=bool)
+    group_begin_mask[1:] = event_time_arr[1:] != event_time_arr[:-1]
+    group_id_arr = np.cumsum(group_begin_mask) - 1
+    group_begin_idx_arr = np.flatnonzero(group_begin_mask)
+    group_last_idx_arr = np.append(group_begin_idx_arr[1:], event_nr) - 1
+
+    # only the first end code of a group closes a trial, the rest of the group is consumed by it
+    end_idx_arr = np.flatnonzero(np.isin(event_code_arr, end_mark_list))
+    end_idx_arr = end_idx_arr[np.unique(group_id_arr[end_idx_arr], return_index=True)[1]]
+    last_idx_arr = group_last_idx_arr[group_id_arr[end_idx_arr]]
+    trial_nr = len(end_idx_arr)
+
+    # trial begins with the group of the last start code since the previous trial
+    prev_last_idx_arr = np.empty(trial_nr, dtype=np.intp)
+    prev_last_idx_arr[:1] = -1
+    prev_last_idx_arr[1:] = last_idx_arr[:-1]
+    start_idx_arr = np.flatnonzero(np.isin(event_code_arr, start_mark_list))
+    start_pos_arr = np.searchsorted(start_idx_arr, end_idx_arr, side="right") - 1
+    last_start_idx_arr = start_idx_arr[np.maximum(start_pos_arr, 0)] if len(start_idx_arr) > 0 else np.full(trial_nr, -1)
+    has_start_mask = (start_pos_arr >= 0) & (last_start_idx_arr > prev_last_idx_arr)
+    begin_idx_arr = prev_last_idx_arr + 1
+    begin_idx_arr[has_start_mask] = group_begin_idx_arr[group_id_arr[last_start_idx_arr[has_start_mask]]]
+
+    # gather events of all trials into one flat buffer, then sort & deduplicate markers per trial
+    length_arr = last_idx_arr - begin_idx_arr + 1
+    trial_id_arr = np.repeat(np.arange(trial_nr), length_arr)
+    flat_offset_arr = np.zeros(trial_nr + 1, dtype=np.intp)
+    np.cumsum(length_arr, out=flat_offset_arr[1:])
+    flat_idx_arr = np.arange(flat_offset_arr[-1]) - np.repeat(flat_offset_arr[:-1] - begin_idx_arr, length_arr)
+    flat_time_arr = event_time_arr[flat_idx_arr]
+    flat_code_arr = event_code_arr[flat_idx_arr]
+
+    order_arr = np.lexsort((flat_code_arr, flat_time_arr, trial_id_arr))
+    trial_id_arr = trial_id_arr[order_arr]
+    mark_time_arr = flat_time_arr[order_arr]
+    mark_code_arr = flat_code_arr[order_arr]
+    unique_mask = np.ones(len(order_arr), dtype=bool)
+    unique_mask[1:] = (trial_id_arr[1:] != trial_id_arr[:-1]) | (mark_time_arr[1:] != mark_time_arr[:-1]) | (mark_code_arr[1:] != mark_code_arr[:-1])
+    trial_id_arr = trial_id_arr[unique_mask]
+    mark_time_arr = np.ascontiguousarray(mark_time_arr[unique_mask], dtype=time_dtype)
+    mark_code_arr = np.ascontiguousarray(mark_code_arr[unique_mask], dtype=code_dtype)
+    mark_offset_arr = np.searchsorted(trial_id_arr, np.arange(trial_nr + 1))
+
+    # trial bounds as set by `_TrialData.insert_mark`: end is the last timestamp, but at least one past the first one
+    if trial_nr > 0:
+        start_time_arr = np.minimum.reduceat(flat_time_arr, flat_offset_arr[:-1]).astype(time_dtype)
+        end_time_arr = np.maximum(np.maximum.reduceat(flat_time_arr, flat_offset_arr[:-1]), event_time_arr[begin_idx_arr] + 1).astype(time_dtype)
+    else:
+        start_time_arr = np.empty(0, dtype=time_dtype)
+        end_time_arr = np.empty(0, dtype=time_dtype)
+    end_code_arr = event_code_arr[end_idx_arr].astype(code_dtype)
+
+    return start_time_arr, end_time_arr, end_code_arr, mark_offset_arr, mark_time_arr, mark_code_arr
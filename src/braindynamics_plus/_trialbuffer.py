@@ -0,0 +1,93 @@
+import numpy as np
+
+def _clip_trial_bounds(samp_nr:int, start_time_arr:np.ndarray, end_time_arr:np.ndarray) -> tuple:
+    # bounds as they would be after slicing `samp_mat[:, start_time:end_time]`
+    start_time_arr = np.clip(np.asarray(start_time_arr, dtype=np.int64), 0, samp_nr)
+    end_time_arr = np.maximum(np.clip(np.asarray(end_time_arr, dtype=np.int64), 0, samp_nr), start_time_arr)
+    return start_time_arr, end_time_arr
+
+def _empty_padded(trial_nr:int, chan_nr:int, length_arr:np.ndarray, dtype, fill_value:float) -> tuple:
+    max_len = int(length_arr.max()) if trial_nr > 0 else 0
+    padded = np.full((trial_nr, chan_nr, max_len), fill_value, dtype=dtype)
+    mask = np.arange(max_len)[None, :] < length_arr[:, None]
+    return padded, mask
+
+class PackedTrials:
+    """ Samples of variable length trials packed into one contiguous buffer.
+
+    Trial `i` occupies `buffer[chan_nr*offset_arr[i]:chan_nr*offset_arr[i+1]]` as a C-ordered (chan_nr x length) block,
+    so indexing returns contiguous views, while the whole object is a single allocation (cheap to pickle or share).
+    """
+
+    def __init__(self, buffer:np.ndarray, offset_arr:np.ndarray, chan_nr:int):
+        self.buffer = buffer
+        self.offset_arr = np.asarray(offset_arr, dtype=np.int64)
+        self.chan_nr = chan_nr
+        if buffer.ndim != 1 or len(buffer) != chan_nr*self.offset_arr[-1]:
+            raise ValueError(f"Buffer of {len(buffer)} samples does not match {chan_nr} channels of {self.offset_arr[-1]} samples")
+
+    @classmethod
+    def pack(cls, samp_mat, start_time_arr:np.ndarray, end_time_arr:np.ndarray) -> "PackedTrials":
+        """ Copy trial samples into a new packed buffer.
+
+        Args:
+            samp_mat: (channel x sample) matrix of the whole recording
+            start_time_arr: array of trial start timestamps
+            end_time_arr: array of trial end timestamps (exclusive)
+
+        Returns:
+            packed trial samples
+        """
+        chan_nr, samp_nr = samp_mat.shape
+        start_time_arr, end_time_arr = _clip_trial_bounds(samp_nr, start_time_arr, end_time_arr)
+        offset_arr = np.zeros(len(start_time_arr) + 1, dtype=np.int64)
+        np.cumsum(end_time_arr - start_time_arr, out=offset_arr[1:])
+        packed = cls(np.empty(chan_nr*offset_arr[-1], dtype=samp_mat.dtype), offset_arr, chan_nr)
+        for trial_idx, (start_time, end_time) in enumerate(zip(start_time_arr.tolist(), end_time_arr.tolist())):
+            packed[trial_idx][...] = samp_mat[:, start_time:end_time]
+        return packed
+
+    def __len__(self) -> int:
+        return len(self.offset_arr) - 1
+
+    def __getitem__(self, trial_idx:int) -> np.ndarray:
+        trial_idx = range(len(self))[trial_idx]
+        first, last = int(self.offset_arr[trial_idx]), int(self.offset_arr[trial_idx + 1])
+        return self.buffer[self.chan_nr*first:self.chan_nr*last].reshape(self.chan_nr, last - first)
+
+    def __iter__(self):
+        for trial_idx in range(len(self)):
+            yield self[trial_idx]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offset_arr)
+
+    def to_list(self) -> list:
+        """ List of (contiguous) views of the trial samples. """
+        return list(self)
+
+    def to_padded(self, fill_value:float=0.0) -> tuple:
+        """ Copy trials into a padded 3D array, see `pad_trials`. """
+        padded, mask = _empty_padded(len(self), self.chan_nr, self.lengths(), self.buffer.dtype, fill_value)
+        for trial_idx, trial_samp_mat in enumerate(self):
+            padded[trial_idx, :, :trial_samp_mat.shape[1]] = trial_samp_mat
+        return padded, mask
+
+def pad_trials(samp_mat, start_time_arr:np.ndarray, end_time_arr:np.ndarray, fill_value:float=0.0) -> tuple:
+    """ Copy trial samples into a padded (trial x channel x max. trial length) array.
+
+    Args:
+        samp_mat: (channel x sample) matrix of the whole recording
+        start_time_arr: array of trial start timestamps
+        end_time_arr: array of trial end timestamps (exclusive)
+        fill_value: value of samples after the end of shorter trials. Defaults to 0.0.
+
+    Returns:
+        tuple of the padded array and a (trial x max. trial length) boolean mask of valid samples
+    """
+    chan_nr, samp_nr = samp_mat.shape
+    start_time_arr, end_time_arr = _clip_trial_bounds(samp_nr, start_time_arr, end_time_arr)
+    padded, mask = _empty_padded(len(start_time_arr), chan_nr, end_time_arr - start_time_arr, samp_mat.dtype, fill_value)
+    for trial_idx, (start_time, end_time) in enumerate(zip(start_time_arr.tolist(), end_time_arr.tolist())):
+        padded[trial_idx, :, :end_time - start_time] = samp_mat[:, start_time:end_time]
+    return padded, mask
@@ -1,4 +1,6 @@
 import bisect
+import numpy as np
+from ._segmentation import segment_trials
 
 # CONSTANTS
 MARK_TIME_IDX = 0 # index of timestamp in tuple representing trial event
@@ -68,4 +70,123 @@ class _TrialData:
         for i in reversed(found_idx):
             del self.mark_list[i]
         self._update_begin_end()
-        return erased_count
\ No newline at end of file
+        return erased_count
+
+class TrialTable:
+    """ Columnar (array-backed) storage of trials.
+
+    Trial bounds and the codes closing the trials are stored in arrays, while markers of all trials share a flat buffer
+    indexed CSR-style: markers of trial `i` are `mark_time_arr[mark_offset_arr[i]:mark_offset_arr[i+1]]` (same for codes).
+    Integer indexing returns a `_TrialData` copy for compatibility, every other indexing/filtering returns a new table.
+    """
+
+    def __init__(self, start_time_arr:np.ndarray=None, end_time_arr:np.ndarray=None, end_code_arr:np.ndarray=None,
+                 mark_offset_arr:np.ndarray=None, mark_time_arr:np.ndarray=None, mark_code_arr:np.ndarray=None):
+        self.start_time_arr = np.empty(0, dtype=np.int32) if start_time_arr is None else np.asarray(start_time_arr)
+        self.end_time_arr = np.empty(0, dtype=np.int32) if end_time_arr is None else np.asarray(end_time_arr)
+        self.end_code_arr = np.empty(0, dtype=np.int32) if end_code_arr is None else np.asarray(end_code_arr)
+        self.mark_offset_arr = np.zeros(1, dtype=np.intp) if mark_offset_arr is None else np.asarray(mark_offset_arr)
+        self.mark_time_arr = np.empty(0, dtype=np.int32) if mark_time_arr is None else np.asarray(mark_time_arr)
+        self.mark_code_arr = np.empty(0, dtype=np.int32) if mark_code_arr is None else np.asarray(mark_code_arr)
+
+        trial_nr = len(self.start_time_arr)
+        if len(self.end_time_arr) != trial_nr or len(self.end_code_arr) != trial_nr or len(self.mark_offset_arr) != trial_nr + 1:
+            raise ValueError("Dimension mismatch between trial arrays")
+        if len(self.mark_time_arr) != len(self.mark_code_arr) or self.mark_offset_arr[-1] - self.mark_offset_arr[0] > len(self.mark_time_arr):
+            raise ValueError("Dimension mismatch between trial marker arrays")
+
+    @classmethod
+    def from_events(cls, event_time_arr:np.ndarray, event_code_arr:np.ndarray, start_mark_list:list[int], end_mark_list:list[int]) -> "TrialTable":
+        """ Divide the event timeline into trials, see `segment_trials`.
+        """
+        return cls(*segment_trials(event_time_arr, event_code_arr, start_mark_list, end_mark_list))
+
+    def __len__(self) -> int:
+        return len(self.start_time_arr)
+
+    def __str__(self) -> str:
+        return f"Table of {len(self)} trials with {self.mark_offset_arr[-1] - self.mark_offset_arr[0]} markers."
+
+    def __iter__(self):
+        for trial_idx in range(len(self)):
+            yield self._get_trial(trial_idx)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            trial_idx = int(key)
+            if not -len(self) <= trial_idx < len(self):
+                raise IndexError(f"Trial index {trial_idx} out of range for {len(self)} trials")
+            return self._get_trial(trial_idx % len(self))
+        if isinstance(key, slice) and key.step in (None, 1):
+            first, last, _ = key.indices(len(self))
+            last = max(first, last)
+            return TrialTable(self.start_time_arr[first:last], self.end_time_arr[first:last], self.end_code_arr[first:last],
+                              self.mark_offset_arr[first:last + 1], self.mark_time_arr, self.mark_code_arr)
+        return self.take(np.arange(len(self))[key])
+
+    def _get_trial(self, trial_idx:int) -> _TrialData:
+        trial = _TrialData()
+        trial.start_time = int(self.start_time_arr[trial_idx])
+        trial.end_time = int(self.end_time_arr[trial_idx])
+        mark_time_arr, mark_code_arr = self.get_marks(trial_idx)
+        trial.mark_list = list(zip(mark_time_arr.tolist(), mark_code_arr.tolist()))
+        return trial
+
+    def get_marks(self, trial_idx:int) -> tuple:
+        """ Get markers of a trial.
+
+        Args:
+            trial_idx: index of the trial
+
+        Returns:
+            tuple of arrays (views) of the marker timestamps & codes
+        """
+        first, last = self.mark_offset_arr[trial_idx], self.mark_offset_arr[trial_idx + 1]
+        return self.mark_time_arr[first:last], self.mark_code_arr[first:last]
+
+    def duration(self) -> np.ndarray:
+        return self.end_time_arr - self.start_time_arr
+
+    def mark_count(self) -> np.ndarray:
+        return np.diff(self.mark_offset_arr)
+
+    def take(self, trial_idx_arr:np.ndarray) -> "TrialTable":
+        """ Select trials by their index.
+
+        Args:
+            trial_idx_arr: array of trial indices (or boolean mask)
+
+        Returns:
+            new table of the selected trials with a compacted marker buffer
+        """
+        trial_idx_arr = np.arange(len(self))[trial_idx_arr]
+        mark_count_arr = self.mark_count()[trial_idx_arr]
+        mark_offset_arr = np.zeros(len(trial_idx_arr) + 1, dtype=np.intp)
+        np.cumsum(mark_count_arr, out=mark_offset_arr[1:])
+        mark_idx_arr = np.arange(mark_offset_arr[-1]) - np.repeat(mark_offset_arr[:-1] - self.mark_offset_arr[trial_idx_arr], mark_count_arr)
+        return TrialTable(self.start_time_arr[trial_idx_arr], self.end_time_arr[trial_idx_arr], self.end_code_arr[trial_idx_arr],
+                          mark_offset_arr, self.mark_time_arr[mark_idx_arr], self.mark_code_arr[mark_idx_arr])
+
+    def filter(self, min_duration:int=None, max_duration:int=None, end_mark_list:list[int]=None) -> "TrialTable":
+        """ Select trials by duration and/or the code closing them.
+
+        Args:
+            min_duration: minimal trial duration (in sampling units, inclusive). Defaults to None (no lower bound).
+            max_duration: maximal trial duration (in sampling units, inclusive). Defaults to None (no upper bound).
+            end_mark_list: keep only trials closed by one of these codes. Defaults to None (any code).
+
+        Returns:
+            new table of the selected trials
+        """
+        mask = np.ones(len(self), dtype=bool)
+        duration_arr = self.duration()
+        if min_duration is not None:
+            mask &= duration_arr >= min_duration
+        if max_duration is not None:
+            mask &= duration_arr <= max_duration
+        if end_mark_list is not None:
+            mask &= np.isin(self.end_code_arr, end_mark_list)
+        return self.take(mask)
+
+    def to_trial_list(self) -> list[_TrialData]:
+        return list(self)
@@ -2,12 +2,24 @@ import braindynamics_starprotocol as bd
 import numpy as np
 import os
 import json
-from ._trialdata import _TrialData
+from collections import OrderedDict
+from ._trialdata import _TrialData, TrialTable
+from ._samples import QuantizedSamples, QUANTIZED_DTYPE_LIST
+from ._segmentation import segment_trials
+from ._trialbuffer import PackedTrials, pad_trials
+from ._eventindex import EventIndex
+from ._preprocessing import design_band_filter, design_antialias_filter, preprocess_samples
+from .instrumentation import instrumented, record_allocation
 import mne
 
 # CONSTANTS
 SAMPLE_DTYPE = np.float32 # data type of samples
 EVENT_DTYPE = np.int32 # data type of event timestamps & markers/codes
+TRIAL_CACHE_SIZE = 16 # default number of trial definitions whose segmentation is cached
+
+def _event_sort_key(event_time_arr:np.ndarray, event_code_arr:np.ndarray) -> np.ndarray:
+    # single int64 key ordering events by timestamp, then by code
+    return (event_time_arr.astype(np.int64) << 32) + (event_code_arr.astype(np.int64) - np.iinfo(EVENT_DTYPE).min)
 
 class BrainData:
     """ Abstract class for storing raw brain activity recordings.
@@ -17,17 +29,44 @@ class BrainData:
         self.chan_nr = 0 # number of channels (variables, e.g. electrodes, ROIs)
         self.samp_nr = 0 # number of samples
         self.samp_freq = 0.0 # sampling frequency (in Hz!!)
-        self.samp_mat = np.empty((self.chan_nr, self.samp_nr), dtype=SAMPLE_DTYPE) # matrix of samples
+        self.samp_mat = np.empty((self.chan_nr, self.samp_nr), dtype=SAMPLE_DTYPE) # matrix of samples (numpy array, lazily loaded `ChannelStack`/`ChannelFileReader` or compact `QuantizedSamples`)
         self.event_nr = 0 # number of events
         self.event_code_arr = np.empty(self.event_nr, dtype=EVENT_DTYPE) # array of event codes/markers
         self.event_time_arr = np.empty(self.event_nr, dtype=EVENT_DTYPE) # array of event timestamps
-        self.trial_nr = 0 # number of trials
-        self.trial_list = list() # list of trials (_TrialData objects)
+        self.trial_table = TrialTable() # table of trials (array-backed)
         self.info_dict = dict() # dictionary of other infos (metadata)
+        self._event_index = None # per-code event index (built on first query)
+        self._event_index_arr_pair = None # event arrays the index was built from
+        self._trial_cache = OrderedDict() # (start codes, end codes, version) -> segmentation (& `TrialBrainData`), least recently used first
+        self._trial_cache_size = TRIAL_CACHE_SIZE # maximal number of cached trial definitions
+        self._trial_cache_trial_data = False # cache `TrialBrainData` built by `get_trial_brain_data` as well
+        self._trial_cache_stat_dict = {"hits": 0, "misses": 0, "evictions": 0}
+        self._trial_cache_version = 0 # bumped whenever events or samples change
 
     def __str__(self)->str:
         return f"Brain activity recording of {self.samp_nr} from {self.chan_nr} channels and a {self.samp_freq}Hz sampling frequency."
 
+    @property
+    def trial_nr(self) -> int:
+        """ Number of trials. """
+        return len(self.trial_table)
+
+    @property
+    def trial_list(self) -> TrialTable:
+        """ Trials as a sequence of `_TrialData` objects (kept for compatibility, built on access from `trial_table`). """
+        return self.trial_table
+
+    @property
+    def event_index(self) -> EventIndex:
+        """ Per-code index of the events (built on first access, rebuilt if the event arrays were replaced). """
+        if self._event_index is None or not self._is_event_index_current():
+            self._event_index = EventIndex(self.event_time_arr, self.event_code_arr)
+            self._event_index_arr_pair = (self.event_time_arr, self.event_code_arr)
+        return self._event_index
+
+    def _is_event_index_current(self) -> bool:
+        return self._event_index_arr_pair is not None and self._event_index_arr_pair[0] is self.event_time_arr and self._event_index_arr_pair[1] is self.event_code_arr
+
     def clear(self):
         """ Function that clears all data.
         """
@@ -38,97 +77,362 @@ class BrainData:
         self.event_nr = 0
         self.event_code_arr = np.empty(self.event_nr, dtype=EVENT_DTYPE)
         self.event_time_arr = np.empty(self.event_nr, dtype=EVENT_DTYPE)
-        self.trial_nr = 0
-        self.trial_list.clear()
+        self.trial_table = TrialTable()
         self.info_dict.clear()
+        self._event_index = None
+        self._event_index_arr_pair = None
+        self._invalidate_trial_cache()
+
+    def set_trial_cache(self, max_size:int=TRIAL_CACHE_SIZE, cache_trial_data:bool=False) -> None:
+        """ Configure the LRU cache of trial segmentations (used whenever marker lists are passed, see `divide_into_trials`).
+
+        Args:
+            max_size: maximal number of cached trial definitions (least recently used ones are evicted), 0 disables caching. Defaults to `TRIAL_CACHE_SIZE`.
+            cache_trial_data: also cache the `TrialBrainData` built by `get_trial_brain_data` (returned as is, so it must not be modified). Defaults to False.
+
+        Raises:
+            ValueError: negative cache size
+        """
+        if max_size < 0:
+            raise ValueError(f"Cache size should not be negative, got {max_size}")
+        self._trial_cache_size = max_size
+        self._trial_cache_trial_data = cache_trial_data
+        if not cache_trial_data:
+            for entry in self._trial_cache.values():
+                entry["trial_data_dict"].clear()
+        self._evict_trial_cache()
+
+    def clear_trial_cache(self) -> None:
+        """ Drop every cached trial segmentation and reset the statistics. """
+        self._trial_cache.clear()
+        self._trial_cache_stat_dict = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def seed_trial_cache(self, start_mark_list:list[int], end_mark_list:list[int], trial_table:TrialTable) -> None:
+        """ Store an existing segmentation of the current events in the trial cache (e.g. computed by another process).
+
+        Args:
+            start_mark_list: list of codes marking start of trial
+            end_mark_list: list of codes marking end of trial
+            trial_table: trials of the current events divided by the given markers (see `divide_into_trials`)
+        """
+        self._put_trial_cache_entry(start_mark_list, end_mark_list, trial_table)
+
+    def trial_cache_info(self) -> dict:
+        """ Statistics of the trial cache.
 
+        Returns:
+            dictionary of the number of hits, misses, evictions, cached trial definitions ("size") and the maximal size
+        """
+        return dict(self._trial_cache_stat_dict, size=len(self._trial_cache), max_size=self._trial_cache_size)
+
+    def _invalidate_trial_cache(self) -> None:
+        # events or samples changed: cached segmentations (& trial samples) are outdated
+        self._trial_cache_version += 1
+        self._trial_cache.clear()
+
+    def _evict_trial_cache(self) -> None:
+        while len(self._trial_cache) > self._trial_cache_size:
+            self._trial_cache.popitem(last=False)
+            self._trial_cache_stat_dict["evictions"] += 1
+
+    def _trial_cache_key(self, start_mark_list:list[int], end_mark_list:list[int]) -> tuple:
+        return (tuple(sorted(set(np.ravel(start_mark_list).tolist()))), tuple(sorted(set(np.ravel(end_mark_list).tolist()))), self._trial_cache_version)
+
+    def _get_trial_cache_entry(self, start_mark_list:list[int], end_mark_list:list[int]) -> dict:
+        # cached entry of the trial definition (None if missing), event arrays replaced directly also invalidate it
+        key = self._trial_cache_key(start_mark_list, end_mark_list)
+        entry = self._trial_cache.get(key)
+        if entry is not None and entry["event_arr_pair"][0] is self.event_time_arr and entry["event_arr_pair"][1] is self.event_code_arr:
+            self._trial_cache.move_to_end(key)
+            self._trial_cache_stat_dict["hits"] += 1
+            return entry
+        self._trial_cache_stat_dict["misses"] += 1
+        return None
+
+    def _put_trial_cache_entry(self, start_mark_list:list[int], end_mark_list:list[int], trial_table:TrialTable) -> dict:
+        entry = {"event_arr_pair": (self.event_time_arr, self.event_code_arr), "trial_table": trial_table, "trial_data_dict": dict()}
+        if self._trial_cache_size > 0:
+            self._trial_cache[self._trial_cache_key(start_mark_list, end_mark_list)] = entry
+            self._evict_trial_cache()
+        return entry
+
+    @instrumented()
+    def quantize_samples(self, storage_dtype:str="int16") -> np.ndarray:
+        """ Store the samples compactly (half the bytes of float32), indexing dequantizes only the requested samples.
+
+        "int16" stores `round((x - offset)/scale)` with `scale = (max - min)/65534` and `offset = (max + min)/2` per channel,
+        so the absolute error is at most `scale/2` (e.g. ~0.003 for a channel spanning +-100 units). "float16" keeps the
+        relative error below 2**-11 (~0.05%) but requires samples within +-65504. The exact maximal error of every channel is returned.
+
+        Args:
+            storage_dtype: "int16" or "float16". Defaults to "int16".
+
+        Returns:
+            array of the maximal absolute error of the dequantized samples for every channel
+
+        Raises:
+            ValueError: unknown storage type; samples out of float16 range
+        """
+        if storage_dtype not in QUANTIZED_DTYPE_LIST:
+            raise ValueError(f"Unknown compact storage type: {storage_dtype}")
+        if isinstance(self.samp_mat, QuantizedSamples):
+            if self.samp_mat.storage_dtype == storage_dtype:
+                return self.samp_mat.max_abs_error_arr
+            raise ValueError(f"Samples are already quantized to {self.samp_mat.storage_dtype}")
+        self.samp_mat = QuantizedSamples.quantize(self.samp_mat, storage_dtype)
+        self._invalidate_trial_cache()
+        record_allocation(self.samp_mat.quant_mat)
+        return self.samp_mat.max_abs_error_arr
+
+    @instrumented()
+    def preprocess(self, reref:str=None, band:tuple=None, filter_type:str="iir", order:int=None, decimate:int=1, block_len:int=65536) -> None:
+        """ Re-reference, band-pass filter and decimate the samples block by block (see `preprocess_samples`).
+
+        Samples are processed in place if `samp_mat` is a writable numpy array and no decimation is requested, otherwise
+        the result is written into a new (channel x ceil(samp_nr/decimate)) float32 array, memory-mapped or quantized
+        samples are only read block by block. Decimation keeps every `decimate`-th sample after an anti-alias low-pass filter,
+        and rescales `samp_freq`, the event timestamps and the trial bounds (rounded to the nearest kept sample).
+
+        NOTE: filters are causal (applied in a single pass), so they delay the signal relative to the events: FIR filters by
+        (order/2) samples, IIR filters by a frequency dependent amount. Timestamps are not shifted to compensate.
+
+        Args:
+            reref: "average" for common average reference. Defaults to None (no re-referencing).
+            band: (low, high) cutoff frequencies (Hz) of the band-pass filter, None for either of them gives a high-/low-pass filter. Defaults to None (no filtering).
+            filter_type: "iir" (Butterworth band-pass, Chebyshev anti-alias filter) or "fir" (Hamming window), see `design_band_filter`. Defaults to "iir".
+            order: order of the band-pass filter. Defaults to None (4 for IIR, 3 periods of the lowest cutoff for FIR).
+            decimate: decimation factor. Defaults to 1 (no decimation).
+            block_len: number of samples processed at once. Defaults to 65536.
+
+        Raises:
+            ValueError: invalid re-referencing, filter or decimation parameters
+        """
+        decimate = int(decimate)
+        if decimate < 1:
+            raise ValueError(f"Decimation factor should be positive, got {decimate}")
+        filter_list = []
+        if band is not None:
+            filter_list.append(design_band_filter(self.samp_freq, band, filter_type=filter_type, order=order))
+        if decimate > 1:
+            filter_list.append(design_antialias_filter(decimate, filter_type=filter_type))
+
+        out_samp_nr = -(-self.samp_nr//decimate)
+        if decimate == 1 and isinstance(self.samp_mat, np.ndarray) and self.samp_mat.flags.writeable:
+            out = self.samp_mat
+        else:
+            out = np.empty((self.chan_nr, out_samp_nr), dtype=SAMPLE_DTYPE)
+            record_allocation(out)
+        preprocess_samples(self.samp_mat, out, reref=reref, filter_list=filter_list, decimate=decimate, block_len=block_len)
+        self.samp_mat = out
+        self._invalidate_trial_cache()
+        if decimate == 1:
+            return
+
+        def _decimate_times(time_arr:np.ndarray, max_time:int) -> np.ndarray:
+            time_arr = np.asarray(time_arr)
+            return np.clip((time_arr.astype(np.int64) + decimate//2)//decimate, 0, max(max_time, 0)).astype(time_arr.dtype)
+
+        last_time = out_samp_nr - 1
+        self.samp_nr = out_samp_nr
+        self.samp_freq = self.samp_freq/decimate
+        self.event_time_arr = _decimate_times(self.event_time_arr, last_time)
+        table = self.trial_table
+        self.trial_table = TrialTable(_decimate_times(table.start_time_arr, last_time), _decimate_times(table.end_time_arr - 1, last_time) + 1,
+                                      table.end_code_arr, table.mark_offset_arr, _decimate_times(table.mark_time_arr, last_time), table.mark_code_arr)
+        self._event_index = None
+        self._event_index_arr_pair = None
+
+    @instrumented()
     def add_events(self, event_time_arr:np.ndarray, event_code_arr:np.ndarray) -> None:
         """ Add new event markers to the data.
 
+        New events are merged into the (time, code)-sorted event arrays, which keep their `EVENT_DTYPE` and contiguity.
+
         Args:
             event_time_arr: array of new event marker timestamps
-            event_code_arr: array of new event marker codes
+            event_code_arr: array of new event marker codes (or a single code used for all the new timestamps)
 
         Raises:
             ValueError: dimension mismatch between timestamp and code arrays
         """
-        if len(event_time_arr) != len(event_code_arr):
-            raise ValueError(f"Dimension mismatch between array of event timestamps ({len(event_time_arr)}) and codes ({len(event_code_arr)})")
-        
-        self.event_time_arr = np.append(self.event_time_arr, event_time_arr)
-        self.event_code_arr = np.append(self.event_code_arr, event_code_arr)
-        self.event_time_arr, self.event_code_arr = zip(*sorted(zip(self.event_time_arr, self.event_code_arr)))
+        self.add_event_groups([(event_time_arr, event_code_arr)])
+
+    @instrumented()
+    def add_event_groups(self, event_group_list:list[tuple]) -> None:
+        """ Add several groups of event markers to the data with a single merge.
+
+        Args:
+            event_group_list: list of (event timestamps, event codes) pairs, the codes can be a single code for the whole group
+
+        Raises:
+            ValueError: dimension mismatch between timestamp and code arrays
+        """
+        new_time_arr_list = []
+        new_code_arr_list = []
+        for event_time_arr, event_code_arr in event_group_list:
+            event_time_arr = np.asarray(event_time_arr, dtype=EVENT_DTYPE).reshape(-1)
+            if np.ndim(event_code_arr) == 0:
+                event_code_arr = np.full(len(event_time_arr), event_code_arr, dtype=EVENT_DTYPE)
+            event_code_arr = np.asarray(event_code_arr, dtype=EVENT_DTYPE).reshape(-1)
+            if len(event_time_arr) != len(event_code_arr):
+                raise ValueError(f"Dimension mismatch between array of event timestamps ({len(event_time_arr)}) and codes ({len(event_code_arr)})")
+            new_time_arr_list.append(event_time_arr)
+            new_code_arr_list.append(event_code_arr)
+
+        new_time_arr = np.concatenate(new_time_arr_list) if len(new_time_arr_list) > 0 else np.empty(0, dtype=EVENT_DTYPE)
+        new_code_arr = np.concatenate(new_code_arr_list) if len(new_code_arr_list) > 0 else np.empty(0, dtype=EVENT_DTYPE)
+        new_key_arr = _event_sort_key(new_time_arr, new_code_arr)
+        new_order_arr = np.argsort(new_key_arr, kind="stable")
+
+        event_time_arr = np.ascontiguousarray(self.event_time_arr, dtype=EVENT_DTYPE)
+        event_code_arr = np.ascontiguousarray(self.event_code_arr, dtype=EVENT_DTYPE)
+        event_key_arr = _event_sort_key(event_time_arr, event_code_arr)
+        if np.any(event_key_arr[1:] < event_key_arr[:-1]): # events loaded from files are not necessarily sorted
+            event_order_arr = np.argsort(event_key_arr, kind="stable")
+            event_time_arr, event_code_arr, event_key_arr = event_time_arr[event_order_arr], event_code_arr[event_order_arr], event_key_arr[event_order_arr]
+
+        update_index = self._event_index is not None and self._is_event_index_current()
+        insert_idx_arr = np.searchsorted(event_key_arr, new_key_arr[new_order_arr], side="right")
+        self.event_time_arr = np.insert(event_time_arr, insert_idx_arr, new_time_arr[new_order_arr])
+        self.event_code_arr = np.insert(event_code_arr, insert_idx_arr, new_code_arr[new_order_arr])
         self.event_nr = len(self.event_time_arr)
+        self._invalidate_trial_cache()
+        record_allocation(self.event_time_arr, self.event_code_arr)
+
+        if update_index:
+            self._event_index.insert(new_time_arr, new_code_arr)
+            self._event_index_arr_pair = (self.event_time_arr, self.event_code_arr)
+
+    @instrumented()
+    def get_event_times(self, event_codes, start_time:int=None, end_time:int=None) -> np.ndarray:
+        """ Get timestamps of events with the given codes, optionally within a time range.
+
+        Args:
+            event_codes: code or list of codes of the events of interest
+            start_time: start of the time range (inclusive). Defaults to None (beginning of the recording).
+            end_time: end of the time range (exclusive). Defaults to None (end of the recording).
+
+        Returns:
+            sorted array of event timestamps (may be a read-only view of the event index, copy it before modifying in place)
+        """
+        return self.event_index.get_times(event_codes, start_time=start_time, end_time=end_time)
+
+    @instrumented()
+    def get_next_event_time(self, event_codes, time:int):
+        """ Get timestamp of the first event with the given codes after a timestamp.
 
+        Args:
+            event_codes: code or list of codes of the events of interest
+            time: reference timestamp (excluded)
+
+        Returns:
+            timestamp of the next event or None if there is no such event
+        """
+        return self.event_index.get_next_time(event_codes, time)
+
+    @instrumented()
     def divide_into_trials(self, start_mark_list:list[int], end_mark_list:list[int]) -> None:
         """ Divide the experimental timeline into trials based on markers.
 
+        Results are kept in an LRU cache keyed by the marker sets (see `set_trial_cache`), so repeating a division is free
+        until the events change (`add_events`, `clear`, reloading or `preprocess`).
+
         Args:
             start_mark_list: list of codes marking start of trial
             end_mark_list: list of codes marking end of trial
         """
-        self.trial_list.clear()
-        self.trial_nr = 0
-        trial = _TrialData()
-        trial.clear()
-
-        event_idx = 0
-        while event_idx < self.event_nr:
-
-            event_code = self.event_code_arr[event_idx]
-            event_time = self.event_time_arr[event_idx]
-
-            if event_code in start_mark_list:
-                trial.clear()
-                trial.insert_mark((event_time, event_code))
-                prev_event_idx = event_idx - 1
-                while prev_event_idx > -1 and self.event_time_arr[prev_event_idx] == event_time:
-                    trial.insert_mark((self.event_time_arr[prev_event_idx], self.event_code_arr[prev_event_idx]))
-                    prev_event_idx -= 1
-            else:
-                trial.insert_mark((event_time, event_code))
-
-            if event_code in end_mark_list:
-                prev_event_idx = event_idx + 1
-                while prev_event_idx < self.event_nr and self.event_time_arr[prev_event_idx]  == event_time:
-                    trial.insert_mark((self.event_time_arr[prev_event_idx], self.event_code_arr[prev_event_idx]))
-                    event_idx = prev_event_idx
-                    prev_event_idx += 1
-                
-                self.trial_nr += 1
-                self.trial_list.append(trial)
-                trial = _TrialData()
-
-            event_idx += 1
-
-    def get_trial_samples(self, start_mark_list:list[int]=None, end_mark_list:list[int]=None)->list:
+        entry = self._get_trial_cache_entry(start_mark_list, end_mark_list)
+        if entry is not None:
+            self.trial_table = entry["trial_table"]
+            return
+        self.trial_table = TrialTable.from_events(self.event_time_arr, self.event_code_arr, start_mark_list, end_mark_list)
+        self._put_trial_cache_entry(start_mark_list, end_mark_list, self.trial_table)
+        record_allocation(self.trial_table.start_time_arr, self.trial_table.end_time_arr, self.trial_table.end_code_arr,
+                          self.trial_table.mark_offset_arr, self.trial_table.mark_time_arr, self.trial_table.mark_code_arr)
+
+    @instrumented()
+    def get_trial_samples(self, start_mark_list:list[int]=None, end_mark_list:list[int]=None, layout:str="list", fill_value:float=0.0):
         """ Fetch trial samples (from all the samples).
 
         Args:
             start_mark_list: event codes marking start of trial. Defaults to None, in which case it is assumed that trials were already divided.
             end_mark_list: event codes marking end of trial. Defaults to None, in which case it is assumed that trials were already divided.
+            layout: "list" returns views of `samp_mat`, "packed" copies all trials into one contiguous `PackedTrials` buffer, "padded" copies them into a (trial x channel x max. length) array. Defaults to "list".
+            fill_value: value of padding samples for "padded" layout. Defaults to 0.0.
  
         Returns:
-            list of numpy arrays representing trial samples
+            list of numpy arrays representing trial samples ("list"); `PackedTrials` ("packed"); tuple of padded array & (trial x max. length) mask of valid samples ("padded")
        
         Raises:
-            ValueError: no marker lists provided and also not divided into trials prior.
+            ValueError: no marker lists provided and also not divided into trials prior; unknown layout.
         """
+        if layout not in ("list", "packed", "padded"):
+            raise ValueError(f"Unknown trial sample layout: {layout}")
+
         if start_mark_list is not None and end_mark_list is not None:
             self.divide_into_trials(start_mark_list, end_mark_list)
 
-        if self.trial_nr == 0 or len(self.trial_list) == 0:
+        if self.trial_nr == 0:
             raise ValueError('Make sure to either divide into trials before or provide trial marker lists.')
 
+        if layout == "packed":
+            packed = PackedTrials.pack(self.samp_mat, self.trial_table.start_time_arr, self.trial_table.end_time_arr)
+            record_allocation(packed.buffer)
+            return packed
+        if layout == "padded":
+            padded, mask = pad_trials(self.samp_mat, self.trial_table.start_time_arr, self.trial_table.end_time_arr, fill_value=fill_value)
+            record_allocation(padded, mask)
+            return padded, mask
+
         trial_samp_list = [] # using list for uneven trial lengths
     
-        for trial_idx in range(self.trial_nr):
-            start_time = self.trial_list[trial_idx].start_time
-            end_time = self.trial_list[trial_idx].end_time
+        for start_time, end_time in zip(self.trial_table.start_time_arr.tolist(), self.trial_table.end_time_arr.tolist()):
             trial_samp_list.append(self.samp_mat[:, start_time:end_time]) # NOTE: end_time or end_time + 1??!
 
+        if not isinstance(self.samp_mat, np.ndarray): # samples read on demand are copies, not views
+            record_allocation(*trial_samp_list)
+
         return trial_samp_list
     
+    def iter_trials(self, start_mark_list:list[int]=None, end_mark_list:list[int]=None, batch_size:int=None):
+        """ Iterate over trial samples, fetching each trial only when it is reached.
+
+        With samples read on demand (e.g. `load_epd_samples(data, mode="pread")`), only the current trial (or batch) is held
+        in memory, so recordings longer than the available memory can be processed.
+
+        Args:
+            start_mark_list: event codes marking start of trial. Defaults to None, in which case it is assumed that trials were already divided.
+            end_mark_list: event codes marking end of trial. Defaults to None, in which case it is assumed that trials were already divided.
+            batch_size: number of trials yielded together in a list. Defaults to None, in which case trials are yielded one by one.
+
+        Yields:
+            numpy array of the trial samples (or list of at most `batch_size` arrays)
+
+        Raises:
+            ValueError: no marker lists provided and also not divided into trials prior; invalid batch size.
+        """
+        if batch_size is not None and batch_size < 1:
+            raise ValueError(f"Batch size should be positive, got {batch_size}")
+
+        if start_mark_list is not None and end_mark_list is not None:
+            self.divide_into_trials(start_mark_list, end_mark_list)
+
+        if self.trial_nr == 0:
+            raise ValueError('Make sure to either divide into trials before or provide trial marker lists.')
+
+        trial_samp_list = []
+        for start_time, end_time in zip(self.trial_table.start_time_arr.tolist(), self.trial_table.end_time_arr.tolist()):
+            if batch_size is None:
+                yield self.samp_mat[:, start_time:end_time]
+                continue
+            trial_samp_list.append(self.samp_mat[:, start_time:end_time])
+            if len(trial_samp_list) == batch_size:
+                yield trial_samp_list
+                trial_samp_list = []
+        if trial_samp_list:
+            yield trial_samp_list
+
+    @instrumented()
     def get_event_samples(self, event_code:EVENT_DTYPE, window_len:EVENT_DTYPE)->list:
         """ Get samples around a specific event in the experiment.
 
@@ -139,7 +443,7 @@ class BrainData:
         Returns:
             list of numpy arrays representing samples around the given event
         """
-        event_timestamps = self.event_time_arr[np.where(self.event_code_arr == event_code)[0]]
+        event_timestamps = self.get_event_times(event_code)
 
         event_samp_list = []
 
@@ -156,12 +460,82 @@ class BrainData:
 
         return event_samp_list
         
-    def get_trial_brain_data(self, start_mark_list:list[int]=None, end_mark_list:list[int]=None)->bd.TrialBrainData:
+    @instrumented()
+    def get_epochs(self, event_codes, pre_len:int=0, post_len:int=0, boundary:str="drop", fill_value:float=0.0, out:np.ndarray=None) -> tuple:
+        """ Get samples around events of interest as a single 3D (epoch x channel x sample) array.
+
+        Windows are `[t - pre_len, t + post_len)` for each event timestamp `t`. If every window lies within the recording,
+        events are evenly spaced and no output buffer is given, the result is a read-only strided view of `samp_mat` (no copy),
+        otherwise the samples are gathered into a single (new or caller-supplied) array.
+
+        Args:
+            event_codes: code or list of codes of the events of interest
+            pre_len: number of samples before the event. Defaults to 0.
+            post_len: number of samples after (and including) the event. Defaults to 0.
+            boundary: handling windows not fully inside the recording: "drop" skips the event, "pad" fills missing samples with `fill_value`, "clip" repeats the first/last sample. Defaults to "drop".
+            fill_value: value of missing samples for "pad" boundary. Defaults to 0.0.
+            out: array of shape (epoch_nr, chan_nr, pre_len + post_len) to store the epochs in. Defaults to None.
+
+        Returns:
+            tuple of the epoch array, timestamps and codes of the events the epochs belong to
+
+        Raises:
+            ValueError: invalid window length or boundary policy; shape mismatch of the output array
+        """
+        if boundary not in ("drop", "pad", "clip"):
+            raise ValueError(f"Unknown boundary policy: {boundary}")
+        window_len = pre_len + post_len
+        if window_len <= 0:
+            raise ValueError(f"Window length should be positive, got {window_len}")
+
+        event_mask = np.isin(self.event_code_arr, event_codes)
+        epoch_time_arr = np.asarray(self.event_time_arr, dtype=EVENT_DTYPE)[event_mask]
+        epoch_code_arr = np.asarray(self.event_code_arr, dtype=EVENT_DTYPE)[event_mask]
+        start_time_arr = epoch_time_arr.astype(np.int64) - pre_len
+        inside_mask = (start_time_arr >= 0) & (start_time_arr + window_len <= self.samp_nr)
+        if boundary == "drop":
+            epoch_time_arr, epoch_code_arr, start_time_arr = epoch_time_arr[inside_mask], epoch_code_arr[inside_mask], start_time_arr[inside_mask]
+            inside_mask = inside_mask[inside_mask]
+        epoch_nr = len(start_time_arr)
+        epoch_shape = (epoch_nr, self.chan_nr, window_len)
+
+        if out is not None:
+            if out.shape != epoch_shape:
+                raise ValueError(f"Shape of output array {out.shape} does not match epochs {epoch_shape}")
+        elif epoch_nr > 0 and isinstance(self.samp_mat, np.ndarray) and np.all(inside_mask):
+            step_arr = np.diff(start_time_arr)
+            if len(step_arr) == 0 or np.all(step_arr == step_arr[0]):
+                step = int(step_arr[0]) if len(step_arr) > 0 else 0
+                chan_stride, samp_stride = self.samp_mat.strides
+                return np.lib.stride_tricks.as_strided(self.samp_mat[:, start_time_arr[0]:], shape=epoch_shape, strides=(step*samp_stride, chan_stride, samp_stride), writeable=False), epoch_time_arr, epoch_code_arr
+
+        if out is None:
+            out = np.empty(epoch_shape, dtype=SAMPLE_DTYPE)
+            record_allocation(out)
+        if epoch_nr == 0:
+            return out, epoch_time_arr, epoch_code_arr
+
+        samp_idx_mat = start_time_arr[:, None] + np.arange(window_len)
+        missing_mask = (samp_idx_mat < 0) | (samp_idx_mat >= self.samp_nr)
+        samp_idx_mat = np.clip(samp_idx_mat, 0, self.samp_nr - 1)
+        for chan_idx in range(self.chan_nr):
+            out[:, chan_idx, :] = self.samp_mat[chan_idx, samp_idx_mat]
+        if boundary == "pad" and np.any(missing_mask):
+            np.copyto(out, fill_value, where=missing_mask[:, None, :])
+
+        return out, epoch_time_arr, epoch_code_arr
+
+    @instrumented()
+    def get_trial_brain_data(self, start_mark_list:list[int]=None, end_mark_list:list[int]=None, packed:bool=False)->bd.TrialBrainData:
         """ Get `braindynamics_starprotocol.BrainData` instance based on defined trials.
 
         Args:
             start_mark_list: event codes marking start of trial. Defaults to None, in which case it is assumed that trials were already divided.
             end_mark_list: event codes marking end of trial. Defaults to None, in which case it is assumed that trials were already divided.
+            packed: copy trial samples into a single contiguous buffer (see `PackedTrials`) instead of using views of `samp_mat`. Defaults to False.
+
+        If enabled with `set_trial_cache(cache_trial_data=True)`, the result is cached along with the segmentation of the
+        marker lists and the same instance is returned while the events and samples are unchanged.
          
         Returns:
             `braindynamics_starprotocl.BrainData` instance storing trial samples & infos.
@@ -169,13 +543,26 @@ class BrainData:
         Raises:
             ValueError: no marker lists provided and also not divided into trials prior.
         """
-        samp_mat_list = self.get_trial_samples(start_mark_list=start_mark_list, end_mark_list=end_mark_list)
+        entry = None
+        if self._trial_cache_trial_data and start_mark_list is not None and end_mark_list is not None:
+            self.divide_into_trials(start_mark_list, end_mark_list)
+            entry = self._trial_cache.get(self._trial_cache_key(start_mark_list, end_mark_list))
+            start_mark_list = end_mark_list = None # already divided
+            samp_mat, trialbraindata = entry["trial_data_dict"].get(packed, (None, None)) if entry is not None else (None, None)
+            if samp_mat is self.samp_mat and trialbraindata is not None:
+                return trialbraindata
+
+        samp_mat_list = self.get_trial_samples(start_mark_list=start_mark_list, end_mark_list=end_mark_list, layout="packed" if packed else "list")
+        if packed:
+            samp_mat_list = samp_mat_list.to_list()
         trialbraindata = bd.TrialBrainData()
         if self.info_dict is None:
             info_dict = None
         else:
             info_dict = self.info_dict
         trialbraindata.load(samp_mat_list, self.samp_freq, info_dict=info_dict)
+        if entry is not None:
+            entry["trial_data_dict"][packed] = (self.samp_mat, trialbraindata)
         return trialbraindata
 
     def set_event_descriptions(self, event_desc_dict:dict)->None:
@@ -184,13 +571,51 @@ class BrainData:
         Args:
             event_desc_dict: dictionary with keys being event codes, and the values their description,
         """
-        self.info["event_description_dict"] = event_desc_dict
+        self.info_dict["event_description_dict"] = event_desc_dict
+
+    def _get_chan_idx_arr(self, picks:list=None) -> np.ndarray:
+        """ Indices of the picked channels (given by names or indices).
+        """
+        if "chan_name_list" not in self.info_dict:
+            raise ValueError("Please load channel names into BrainData.info_dict['chan_name_list'].")
+
+        if len(self.info_dict["chan_name_list"]) != self.chan_nr:
+            raise ValueError("Make sure that all loaded channels have their name in the info dict.")
 
-    def convert_to_mne_raw(self, unit:float=1.0e-6):
+        if picks is None:
+            return np.arange(self.chan_nr)
+        chan_idx_list = []
+        for pick in picks:
+            if isinstance(pick, str):
+                if pick not in self.info_dict["chan_name_list"]:
+                    raise ValueError(f"Channel {pick} not found.")
+                chan_idx_list.append(self.info_dict["chan_name_list"].index(pick))
+            else:
+                if not 0 <= pick < self.chan_nr:
+                    raise ValueError(f"Channel index {pick} out of range for {self.chan_nr} channels.")
+                chan_idx_list.append(int(pick))
+        return np.array(chan_idx_list, dtype=np.intp)
+
+    def _get_event_description(self, event_code:int) -> str:
+        event_desc_dict = self.info_dict.get("event_description_dict", {})
+        return event_desc_dict.get(event_code, event_desc_dict.get(str(event_code), str(event_code)))
+
+    def _get_event_id_dict(self, event_code_list:list[int]) -> dict:
+        # MNE event_id (description -> code), codes sharing a description are told apart by their code
+        desc_list = [self._get_event_description(event_code) for event_code in event_code_list]
+        return {desc if desc_list.count(desc) == 1 else f"{desc} ({event_code})": event_code for desc, event_code in zip(desc_list, event_code_list)}
+
+    @instrumented()
+    def convert_to_mne_raw(self, unit:float=1.0e-6, picks:list=None, chunk_len:int=65536):
         """ Convert data to the MNE Raw format
 
+        Samples are scaled chunk by chunk into a single preallocated float64 array (which also holds the stim channel),
+        that is handed to MNE without further copies, so peak memory stays close to the size of the output.
+
         Args:
             unit: voltage unit multiplier
+            picks: names or indices of the exported channels. Defaults to None (all channels).
+            chunk_len: number of samples scaled at once. Defaults to 65536.
 
         Returns:
             MNE Raw instance of the samples.
@@ -202,31 +627,84 @@ class BrainData:
         if self.samp_nr == 0 or self.chan_nr == 0:
             raise ValueError("EEG data not loaded, no samples/channels were found.")
 
-        if "chan_name_list" not in self.info_dict:
-            raise ValueError("Please load channel names into BrainData.info_dict['chan_name_list'].")
+        chan_idx_arr = self._get_chan_idx_arr(picks)
+        row_key = slice(None) if picks is None else chan_idx_arr
+        chan_name_list = [self.info_dict["chan_name_list"][chan_idx] for chan_idx in chan_idx_arr]
+        pick_nr = len(chan_name_list)
+        has_events = self.event_nr > 0
 
-        if len(self.info_dict["chan_name_list"]) != self.chan_nr:
-            raise ValueError("Make sure that all loaded channels have their name in the info dict.")
+        raw_data = np.empty((pick_nr + has_events, self.samp_nr), dtype=np.float64)
+        record_allocation(raw_data)
+        for start in range(0, self.samp_nr, chunk_len):
+            end = min(start + chunk_len, self.samp_nr)
+            np.multiply(self.samp_mat[row_key, start:end], unit, out=raw_data[:pick_nr, start:end])
 
-        info = mne.create_info(ch_names=self.info_dict["chan_name_list"], sfreq=self.samp_freq, ch_types="eeg")
-        raw = mne.io.RawArray(unit*self.samp_mat, info)
-        if self.event_nr > 0:
- 
-            events = np.column_stack((self.event_time_arr, np.zeros(self.event_nr, EVENT_DTYPE), self.event_code_arr))
-            unique_events = np.unique(self.event_code_arr)
+        if not has_events:
+            info = mne.create_info(ch_names=chan_name_list, sfreq=self.samp_freq, ch_types="eeg")
+            return mne.io.RawArray(raw_data, info, copy="auto")
 
-            info = mne.create_info(ch_names=["STI 014"], sfreq=self.samp_freq, ch_types=["stim"])
-            stim_raw = mne.io.RawArray(np.zeros((1, len(raw.times)), dtype=int), info)
-            raw.add_channels([stim_raw], force_update_info=True)
+        raw_data[pick_nr] = 0.0
+        info = mne.create_info(ch_names=chan_name_list + ["STI 014"], sfreq=self.samp_freq, ch_types=["eeg"]*pick_nr + ["stim"])
+        raw = mne.io.RawArray(raw_data, info, copy="auto")
 
-            if "event_description_dict" in self.info_dict:
-                if len(self.info_dict["event_description_dict"]) < len(unique_events):
-                    raise ValueError("Make sure that all loaded events have their name/description set in the info dict.")
-            else:
-                raise Warning("Event descriptions not found. Resulting to default names for events (string versions of the codes)")
-            
-            raw.add_events(events, stim_channel="STI 014")
+        events = np.column_stack((self.event_time_arr, np.zeros(self.event_nr, EVENT_DTYPE), self.event_code_arr))
+        unique_events = np.unique(self.event_code_arr)
+
+        if "event_description_dict" in self.info_dict:
+            if len(self.info_dict["event_description_dict"]) < len(unique_events):
+                raise ValueError("Make sure that all loaded events have their name/description set in the info dict.")
+        else:
+            raise Warning("Event descriptions not found. Resulting to default names for events (string versions of the codes)")
+
+        raw.add_events(events, stim_channel="STI 014")
 
         return raw
 
+    @instrumented()
+    def convert_to_mne_epochs(self, unit:float=1.0e-6, picks:list=None, window_len:int=None, start_mark_list:list[int]=None, end_mark_list:list[int]=None):
+        """ Convert trials to the MNE Epochs format (without converting the whole recording).
+
+        Every epoch starts at the beginning of a trial, its event is the code that closed the trial. Samples are gathered
+        and scaled directly into the (epoch x channel x sample) float64 array handed to MNE.
+
+        Args:
+            unit: voltage unit multiplier
+            picks: names or indices of the exported channels. Defaults to None (all channels).
+            window_len: length of the epochs in sampling units. Defaults to None, in which case the shortest trial's duration is used (every epoch lies within its trial).
+            start_mark_list: event codes marking start of trial. Defaults to None, in which case it is assumed that trials were already divided.
+            end_mark_list: event codes marking end of trial. Defaults to None, in which case it is assumed that trials were already divided.
+
+        Returns:
+            MNE EpochsArray instance of the trials (trials whose window runs past the recording are left out).
+
+        Raises:
+            ValueError: error occuring, mostly due to insufficient data.
+        """
+        if self.samp_nr == 0 or self.chan_nr == 0:
+            raise ValueError("EEG data not loaded, no samples/channels were found.")
+
+        if start_mark_list is not None and end_mark_list is not None:
+            self.divide_into_trials(start_mark_list, end_mark_list)
+
+        if self.trial_nr == 0:
+            raise ValueError('Make sure to either divide into trials before or provide trial marker lists.')
+
+        chan_idx_arr = self._get_chan_idx_arr(picks)
+        chan_name_list = [self.info_dict["chan_name_list"][chan_idx] for chan_idx in chan_idx_arr]
+        window_len = int(self.trial_table.duration().min()) if window_len is None else window_len
+        if window_len <= 0:
+            raise ValueError(f"Window length should be positive, got {window_len}")
+
+        trial_table = self.trial_table[(self.trial_table.start_time_arr >= 0) & (self.trial_table.start_time_arr.astype(np.int64) + window_len <= self.samp_nr)]
+        samp_idx_mat = trial_table.start_time_arr.astype(np.int64)[:, None] + np.arange(window_len)
+
+        epoch_data = np.empty((len(trial_table), len(chan_idx_arr), window_len), dtype=np.float64)
+        record_allocation(epoch_data)
+        for i, chan_idx in enumerate(chan_idx_arr.tolist()):
+            np.multiply(self.samp_mat[chan_idx, samp_idx_mat], unit, out=epoch_data[:, i, :])
+
+        events = np.column_stack((trial_table.start_time_arr, np.zeros(len(trial_table), EVENT_DTYPE), trial_table.end_code_arr)).astype(np.int64)
+        event_id = self._get_event_id_dict(np.unique(trial_table.end_code_arr).tolist())
+        info = mne.create_info(ch_names=chan_name_list, sfreq=self.samp_freq, ch_types="eeg")
+        return mne.EpochsArray(epoch_data, info, events=events, tmin=0.0, event_id=event_id if event_id else None)
 
@@ -0,0 +1,131 @@
+""" Opt-in timing & memory instrumentation of the pipeline stages.
+
+`BrainData` methods and the `io` loaders are wrapped with `instrumented`, which calls straight through unless an
+`Instrumentation` context is active, so the overhead is a single list check when disabled.
+
+Example:
+    with Instrumentation() as inst:
+        load_epd(data, epd_file_path)
+        data.get_trial_samples(start_mark_list, end_mark_list)
+    print(inst.to_json())
+"""
+import functools
+import json
+import threading
+import time
+
+_active_inst_list = [] # active `Instrumentation` objects
+
+class Instrumentation:
+    """ Context manager collecting call counts, latencies, bytes read and arrays allocated per stage.
+
+    Args:
+        callback: function called as `callback(call_dict)` after every instrumented call (with the stage name, its latency, bytes read & allocated). Defaults to None.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.stage_dict = dict() # stage name -> accumulated statistics
+        self._local = threading.local() # stack of open calls (per thread)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "Instrumentation":
+        _active_inst_list.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        _active_inst_list.remove(self)
+
+    def _call_stack(self) -> list:
+        if not hasattr(self._local, "call_stack"):
+            self._local.call_stack = []
+        return self._local.call_stack
+
+    def _begin(self, stage:str) -> dict:
+        call_dict = {"stage": stage, "seconds": 0.0, "bytes_read": 0, "bytes_allocated": 0, "arrays_allocated": 0, "error": False}
+        self._call_stack().append(call_dict)
+        return call_dict
+
+    def _end(self, call_dict:dict, seconds:float, error:bool) -> None:
+        popped_call_dict = self._call_stack().pop() # calls are strictly nested within a thread
+        assert popped_call_dict is call_dict, "Instrumented calls ended out of order"
+        call_dict["seconds"] = seconds
+        call_dict["error"] = error
+        with self._lock:
+            stage_dict = self.stage_dict.setdefault(call_dict["stage"], {
+                "calls": 0, "errors": 0, "total_seconds": 0.0, "min_seconds": float("inf"), "max_seconds": 0.0,
+                "bytes_read": 0, "bytes_allocated": 0, "arrays_allocated": 0})
+            stage_dict["calls"] += 1
+            stage_dict["errors"] += error
+            stage_dict["total_seconds"] += seconds
+            stage_dict["min_seconds"] = min(stage_dict["min_seconds"], seconds)
+            stage_dict["max_seconds"] = max(stage_dict["max_seconds"], seconds)
+            for key in ("bytes_read", "bytes_allocated", "arrays_allocated"):
+                stage_dict[key] += call_dict[key]
+        if self.callback is not None:
+            self.callback(call_dict)
+
+    def _add(self, key:str, value:int) -> None:
+        # counted for every open call of the thread (nested stages include the counts of their sub-stages)
+        for call_dict in self._call_stack():
+            call_dict[key] += value
+
+    def report(self) -> dict:
+        """ Statistics of every stage.
+
+        Returns:
+            dictionary with stage names as keys and dictionaries of call count, errors, total/min/max/mean latency (seconds), bytes read, bytes & number of arrays allocated as values
+        """
+        with self._lock:
+            report_dict = {stage: dict(stage_dict) for stage, stage_dict in self.stage_dict.items()}
+        for stage_dict in report_dict.values():
+            stage_dict["mean_seconds"] = stage_dict["total_seconds"]/stage_dict["calls"] if stage_dict["calls"] > 0 else 0.0
+        return report_dict
+
+    def to_json(self, indent:int=4) -> str:
+        return json.dumps(self.report(), indent=indent)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stage_dict.clear()
+
+def instrumented(stage:str=None):
+    """ Decorator recording calls of a function in the active `Instrumentation` contexts.
+
+    Args:
+        stage: name of the stage. Defaults to None, in which case the qualified name of the function is used.
+    """
+    def decorator(func):
+        stage_name = func.__qualname__ if stage is None else stage
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active_inst_list:
+                return func(*args, **kwargs)
+            inst_list = list(_active_inst_list)
+            call_dict_list = [inst._begin(stage_name) for inst in inst_list]
+            error = True
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                seconds = time.perf_counter() - start
+                for inst, call_dict in zip(inst_list, call_dict_list):
+                    inst._end(call_dict, seconds, error)
+        return wrapper
+    return decorator
+
+def record_bytes_read(byte_nr:int) -> None:
+    """ Account bytes read from disk to the running stages. """
+    for inst in _active_inst_list:
+        inst._add("bytes_read", int(byte_nr))
+
+def record_allocation(*arr_list) -> None:
+    """ Account newly allocated arrays to the running stages. """
+    if not _active_inst_list:
+        return
+    for inst in _active_inst_list:
+        inst._add("arrays_allocated", len(arr_list))
+        inst._add("bytes_allocated", sum(arr.nbytes for arr in arr_list))
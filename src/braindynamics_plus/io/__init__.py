@@ -1 +1,2 @@
-from .epd import *
\ No newline at end of file
+from .epd import *
+from .dataset import *
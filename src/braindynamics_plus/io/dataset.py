@@ -0,0 +1,96 @@
+from ..braindata import *
+from .epd import load_epd_header, load_epd
+import numpy as np
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+def get_subject_epd_path(root_dir:str, subject_name:str) -> str:
+    """ Path of the .epd file of a subject in a dataset (`<root_dir>/<subject>/<subject>.epd`).
+    """
+    return os.path.join(root_dir, subject_name, f"{subject_name}.epd")
+
+def list_epd_subjects(root_dir:str) -> list[str]:
+    """ Names of the subjects of a dataset (directories of `root_dir` containing `<subject>.epd`), in sorted order.
+    """
+    return sorted(name for name in os.listdir(root_dir) if os.path.isfile(get_subject_epd_path(root_dir, name)))
+
+def _as_list(value) -> list:
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def iter_epd_dataset(root_dir:str, subject_list:list[str]=None, chan_names:list=None, trial_list:list[dict]=None, prefetch:int=1,
+                     memory_limit:int=None, mode:str="memory", workers:int=1, use_cache:bool=True):
+    """ Iterate over the subjects of a dataset, loading the next subjects in background threads while the current one is processed.
+
+    Subjects are yielded in a deterministic order (the given one, or sorted names). While a subject is processed by the
+    caller, the next `prefetch` subjects are loaded (and divided into trials) by background threads, as long as the
+    samples held by the iterator (current subject included) fit into `memory_limit`. A subject exceeding the limit alone
+    is still loaded, but only once nothing else is held. Loading errors are raised when the subject is reached.
+
+    Args:
+        root_dir: root directory of the dataset (`<root_dir>/<subject>/<subject>.epd`)
+        subject_list: names of the subjects. Defaults to None, in which case every subject of `root_dir` is used (see `list_epd_subjects`).
+        chan_names: names (or indices) of the channels to load, see `load_epd`. Defaults to None (all channels).
+        trial_list: trial definitions with "START_CODE", "END_CODE" and optionally "NAME" keys (same as in the configuration files). Defaults to None (no trials).
+        prefetch: number of subjects loaded ahead. Defaults to 1 (0 loads every subject when it is reached).
+        memory_limit: maximal number of bytes of samples held at once, only samples read into memory count ("memory" mode). Defaults to None (no limit).
+        mode: sample loading mode, see `load_epd_samples`. Defaults to "memory".
+        workers: number of threads reading the channel binaries of a subject, see `load_epd_samples`. Defaults to 1.
+        use_cache: load from cache files if they are up-to-date, see `load_epd`. Defaults to True.
+
+    Yields:
+        tuple of the subject name, its `BrainData` and a dictionary of its `TrialTable` for every trial definition (by name, "trial_<index>" if unnamed)
+
+    Raises:
+        ValueError: invalid number of prefetched subjects; error while loading a subject
+    """
+    if prefetch < 0:
+        raise ValueError(f"Number of prefetched subjects should not be negative, got {prefetch}")
+    subject_list = list_epd_subjects(root_dir) if subject_list is None else list(subject_list)
+    trial_list = [] if trial_list is None else _as_list(trial_list)
+    for trial in trial_list:
+        if "START_CODE" not in trial or "END_CODE" not in trial:
+            raise ValueError(f"Trial definition {trial} should have both START_CODE and END_CODE")
+
+    def _load(subject_name:str) -> tuple:
+        data = BrainData()
+        load_epd(data, get_subject_epd_path(root_dir, subject_name), mode=mode, workers=workers, use_cache=use_cache, chan_names=chan_names)
+        trial_table_dict = {}
+        for i, trial in enumerate(trial_list):
+            trial_table_dict[trial.get("NAME", f"trial_{i}")] = TrialTable.from_events(data.event_time_arr, data.event_code_arr, _as_list(trial["START_CODE"]), _as_list(trial["END_CODE"]))
+        return data, trial_table_dict
+
+    nbytes_dict = {} # subject name -> number of bytes of samples held in memory once loaded
+    def _samp_nbytes(subject_name:str) -> int:
+        if mode != "memory" or memory_limit is None:
+            return 0
+        if subject_name not in nbytes_dict:
+            header = BrainData()
+            load_epd_header(header, get_subject_epd_path(root_dir, subject_name), chan_names=chan_names)
+            nbytes_dict[subject_name] = header.chan_nr*header.samp_nr*np.dtype(SAMPLE_DTYPE).itemsize
+        return nbytes_dict[subject_name]
+
+    pending_subject_queue = deque(subject_list)
+    loading_queue = deque() # (subject name, sample bytes, future) in order of submission
+
+    def _submit(max_loading_nr:int, current_nbytes:int) -> None:
+        while pending_subject_queue and len(loading_queue) < max_loading_nr:
+            next_nbytes = _samp_nbytes(pending_subject_queue[0])
+            held_nbytes = current_nbytes + sum(loading[1] for loading in loading_queue)
+            if memory_limit is not None and (held_nbytes > 0 or loading_queue) and held_nbytes + next_nbytes > memory_limit:
+                return
+            subject_name = pending_subject_queue.popleft()
+            loading_queue.append((subject_name, next_nbytes, executor.submit(_load, subject_name)))
+
+    with ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+        try:
+            while pending_subject_queue or loading_queue:
+                _submit(1, 0) # the previous subject is released, make sure the next one is loading
+                subject_name, samp_nbytes, future = loading_queue.popleft()
+                data, trial_table_dict = future.result()
+                _submit(prefetch, samp_nbytes) # load ahead while the current subject is processed
+                yield subject_name, data, trial_table_dict
+                data = trial_table_dict = None
+        finally:
+            for _, _, future in loading_queue:
+                future.cancel()
@@ -1,6 +1,21 @@
 from ..braindata import *
+from ..instrumentation import instrumented, record_allocation, record_bytes_read
+from .._samples import ChannelStack, ChannelFileReader, QuantizedSamples, QUANTIZED_DTYPE_LIST, quantize_row
 import numpy as np
 import os
+import time
+import json
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# CONSTANTS
+EPD_CACHE_MAGIC = b"EPDCACHE" # first bytes of a cache file
+EPD_CACHE_VERSION = 2 # version of the cache layout
+EPD_CACHE_EXT = ".epdcache" # default extension of cache files (next to the .epd file)
+_EPD_CACHE_PREAMBLE = struct.Struct("<8sIIQQQ") # magic, version, reserved, header length, event offset, sample offset
+_EPD_CACHE_ALIGN = 4096 # alignment of the sample block (page size)
+_EPD_CACHE_QUANT_DTYPE = np.dtype([("scale", "<f4"), ("offset", "<f4"), ("max_abs_error", "<f8")]) # per-channel record of quantized caches
 
 def _line_skip_read(file, skip_nr:int) -> str:
     skip_nr = max(0, skip_nr)
@@ -8,15 +23,25 @@ def _line_skip_read(file, skip_nr:int) -> str:
         file.readline()
     return file.readline().replace('\n', '')
 
-def load_epd_header(data:BrainData, epd_file_path:str) -> None:
+def _select_channels(data:BrainData, chan_names:list) -> np.ndarray:
+    # keep only the picked channels (names or indices) in the channel infos, return their indices in the recording
+    chan_idx_arr = data._get_chan_idx_arr(chan_names)
+    data.info_dict["chan_fnames"] = [data.info_dict["chan_fnames"][chan_idx] for chan_idx in chan_idx_arr]
+    data.info_dict["chan_name_list"] = [data.info_dict["chan_name_list"][chan_idx] for chan_idx in chan_idx_arr]
+    data.chan_nr = len(chan_idx_arr)
+    return chan_idx_arr
+
+@instrumented()
+def load_epd_header(data:BrainData, epd_file_path:str, chan_names:list=None) -> None:
     """ Load .epd header file only.
 
     Args:
         data: `braindynamics_plus.BrainData` instance used for storing brain activity recordings
         epd_file_path: path to .epd file
+        chan_names: names (or indices) of the channels to keep, in the given order. Defaults to None (all channels).
 
     Raises:
-        ValueError: error occuring during .epd parsing; dimension mismatch between event timestamps & markers 
+        ValueError: error occuring during .epd parsing; dimension mismatch between event timestamps & markers; unknown channel
     """
     data.clear()
         
@@ -49,6 +74,8 @@ def load_epd_header(data:BrainData, epd_file_path:str) -> None:
                 data.info_dict["chan_name_list"].append(epd_file.readline().replace('\n', ''))
         except:
             raise ValueError(f"Unable to parse EPD data from {epd_file_path}")
+        if chan_names is not None:
+            _select_channels(data, chan_names)
             
         try:
             data.event_time_arr = np.fromfile(os.path.join(data.info_dict["epd_dir"], data.info_dict["event_time_fname"]), dtype=EVENT_DTYPE, sep="")
@@ -57,29 +84,305 @@ def load_epd_header(data:BrainData, epd_file_path:str) -> None:
                 raise ValueError(f"Dimension mismatch between array of event timestamps ({len(data.event_time_arr)}) and codes ({len(data.event_code_arr)})")
         except:
             raise ValueError(f"Unable to load event data")
+        record_bytes_read(epd_file.tell() + data.event_time_arr.nbytes + data.event_code_arr.nbytes)
+        record_allocation(data.event_time_arr, data.event_code_arr)
             
-def load_epd_samples(data:BrainData) -> None:
+def _read_chan_file(chan_file_path:str, samp_row:np.ndarray) -> dict:
+    """ Read a channel binary directly into a preallocated (contiguous) row of the sample matrix.
+
+    Returns:
+        dictionary with the file name, number of bytes read, elapsed seconds and throughput (MB/s)
+    """
+    start = time.perf_counter()
+    with open(chan_file_path, "rb", buffering=0) as chan_file:
+        file_size = os.fstat(chan_file.fileno()).st_size
+        if file_size != samp_row.nbytes:
+            raise ValueError(f"Size of {chan_file_path} ({file_size} bytes) does not match the number of samples ({samp_row.nbytes} bytes)")
+        buffer = memoryview(samp_row).cast("B")
+        read_nr = 0
+        while read_nr < file_size:
+            chunk_nr = chan_file.readinto(buffer[read_nr:])
+            if not chunk_nr:
+                raise ValueError(f"Unexpected end of file in {chan_file_path}")
+            read_nr += chunk_nr
+    seconds = time.perf_counter() - start
+    return {"fname": os.path.basename(chan_file_path), "bytes": read_nr, "seconds": seconds, "throughput_mbps": read_nr/seconds/1.0e6 if seconds > 0 else float("inf")}
+
+@instrumented()
+def load_epd_samples(data:BrainData, mode:str="memory", workers:int=1) -> dict:
     """ Load samples based on .epd file.
 
     Args:
         data: `braindynamics_plus.BrainData` instance used for storing brain activity recording
+        mode: "memory" reads every channel into a single matrix, "mmap" memory-maps the channel binaries and stores a lazy `ChannelStack` (only the sliced samples are read from disk), "pread" stores a `ChannelFileReader` reading the sliced samples with positioned reads (nothing mapped or cached). Defaults to "memory".
+        workers: number of threads reading channel binaries concurrently in "memory" mode. Defaults to 1 (serial reading).
+
+    Returns:
+        read statistics: per-file list (`"file_list"`) and aggregate bytes, wall time (seconds) and throughput (MB/s)
 
     Raises:
-        ValueError: error occurs during reading samples from binaries.
+        ValueError: error occurs during reading samples from binaries; unknown loading mode.
     """
+    if mode not in ("memory", "mmap", "pread"):
+        raise ValueError(f"Unknown sample loading mode: {mode}")
+    if workers < 1:
+        raise ValueError(f"Number of workers should be positive, got {workers}")
+
+    chan_file_path_list = [os.path.join(data.info_dict["epd_dir"], chan_fname) for chan_fname in data.info_dict["chan_fnames"]]
+    file_stat_list = []
+    start = time.perf_counter()
     try:
-        data.samp_mat = np.empty((data.chan_nr, data.samp_nr), dtype=SAMPLE_DTYPE)
-        for i, chan_fname in enumerate(data.info_dict["chan_fnames"]):
-            data.samp_mat[i, :] = np.fromfile(os.path.join(data.info_dict["epd_dir"], chan_fname), dtype=SAMPLE_DTYPE, sep="")
+        if mode == "mmap":
+            chan_list = []
+            for chan_file_path in chan_file_path_list:
+                chan_list.append(np.memmap(chan_file_path, dtype=SAMPLE_DTYPE, mode="r", shape=(data.samp_nr,)))
+            data.samp_mat = ChannelStack(chan_list, dtype=SAMPLE_DTYPE)
+        elif mode == "pread":
+            data.samp_mat = ChannelFileReader(chan_file_path_list, data.samp_nr, dtype=SAMPLE_DTYPE)
+        else:
+            data.samp_mat = np.empty((data.chan_nr, data.samp_nr), dtype=SAMPLE_DTYPE)
+            if workers == 1:
+                for i, chan_file_path in enumerate(chan_file_path_list):
+                    file_stat_list.append(_read_chan_file(chan_file_path, data.samp_mat[i, :]))
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    file_stat_list = list(executor.map(_read_chan_file, chan_file_path_list, data.samp_mat))
     except:
         raise ValueError("Unable to load sample data")
+    seconds = time.perf_counter() - start
 
-def load_epd(data:BrainData, epd_file_path:str) -> None:
-    """ Loading .epd header and data (samples) as well.
+    byte_nr = sum(file_stat["bytes"] for file_stat in file_stat_list)
+    record_bytes_read(byte_nr)
+    if mode == "memory":
+        record_allocation(data.samp_mat)
+    return {"mode": mode, "workers": workers, "file_list": file_stat_list, "bytes": byte_nr, "seconds": seconds, "throughput_mbps": byte_nr/seconds/1.0e6 if seconds > 0 else float("inf")}
+
+def iter_epd_trials(data:BrainData, epd_file_path:str, start_mark_list:list[int], end_mark_list:list[int], batch_size:int=None):
+    """ Stream trials of an .epd recording without loading the samples.
+
+    Only the header & events are loaded, then every trial is read from the channel binaries with positioned reads when it
+    is reached, so peak memory is proportional to the longest trial (or batch).
 
     Args:
         data: `braindynamics_plus.BrainData` instance used for storing brain activity recording
         epd_file_path: path to .epd file
+        start_mark_list: event codes marking start of trial
+        end_mark_list: event codes marking end of trial
+        batch_size: number of trials yielded together, see `BrainData.iter_trials`. Defaults to None.
+
+    Yields:
+        numpy array of the trial samples (or list of at most `batch_size` arrays)
     """
     load_epd_header(data, epd_file_path)
-    load_epd_samples(data)
+    load_epd_samples(data, mode="pread")
+    yield from data.iter_trials(start_mark_list, end_mark_list, batch_size=batch_size)
+
+def _align(offset:int, alignment:int) -> int:
+    return (offset + alignment - 1)//alignment*alignment
+
+def _epd_source_stamp_list(epd_file_path:str, info_dict:dict) -> list[dict]:
+    # size & modification time of every file the recording is read from
+    epd_dir = os.path.dirname(epd_file_path)
+    fname_list = [os.path.basename(epd_file_path), info_dict["event_time_fname"], info_dict["event_code_fname"]] + list(info_dict["chan_fnames"])
+    stamp_list = []
+    for fname in fname_list:
+        stat = os.stat(os.path.join(epd_dir, fname))
+        stamp_list.append({"fname": fname, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return stamp_list
+
+def get_epd_cache_path(epd_file_path:str) -> str:
+    """ Default path of the cache belonging to an .epd file.
+    """
+    return os.path.splitext(epd_file_path)[0] + EPD_CACHE_EXT
+
+def _read_epd_cache_header(cache_file_path:str) -> dict:
+    with open(cache_file_path, "rb") as cache_file:
+        magic, version, _, header_len, event_offset, samp_offset = _EPD_CACHE_PREAMBLE.unpack(cache_file.read(_EPD_CACHE_PREAMBLE.size))
+        if magic != EPD_CACHE_MAGIC or version != EPD_CACHE_VERSION:
+            raise ValueError(f"{cache_file_path} is not an EPD cache (version {EPD_CACHE_VERSION})")
+        header = json.loads(cache_file.read(header_len).decode("utf-8"))
+    header["event_offset"] = event_offset
+    header["quant_offset"] = _align(event_offset + 2*header["event_nr"]*np.dtype(header["event_dtype"]).itemsize, 64)
+    header["samp_offset"] = samp_offset
+    return header
+
+@instrumented()
+def save_epd_cache(epd_file_path:str, cache_file_path:str=None, sample_dtype:str="float32") -> str:
+    """ Convert an .epd recording into a single cache file.
+
+    The cache holds a JSON header, the events, the per-channel quantization parameters (compact storage only) and the
+    (channel x sample) block (channel-contiguous, page-aligned), so it can be opened with a single memory-map. Channel
+    binaries are copied (or quantized) one by one, the samples are never loaded entirely.
+
+    Args:
+        epd_file_path: path to .epd file
+        cache_file_path: path of the cache file. Defaults to None, in which case `get_epd_cache_path` is used.
+        sample_dtype: storage type of the samples, "float32" (exact) or "int16"/"float16" (half size, see `BrainData.quantize_samples` for the error bound). Defaults to "float32".
+
+    Returns:
+        path of the cache file
+
+    Raises:
+        ValueError: error occuring during .epd parsing or copying of the binaries; unknown storage type
+    """
+    if sample_dtype != "float32" and sample_dtype not in QUANTIZED_DTYPE_LIST:
+        raise ValueError(f"Unknown sample storage type: {sample_dtype}")
+    cache_file_path = get_epd_cache_path(epd_file_path) if cache_file_path is None else cache_file_path
+    data = BrainData()
+    load_epd_header(data, epd_file_path)
+
+    header = {
+        "chan_nr": data.chan_nr,
+        "samp_nr": data.samp_nr,
+        "samp_freq": data.samp_freq,
+        "event_nr": len(data.event_time_arr),
+        "sample_dtype": np.dtype(sample_dtype).str,
+        "event_dtype": np.dtype(EVENT_DTYPE).str,
+        "info_dict": data.info_dict,
+        "source_list": _epd_source_stamp_list(epd_file_path, data.info_dict),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    event_offset = _align(_EPD_CACHE_PREAMBLE.size + len(header_bytes), 64)
+    quant_offset = _align(event_offset + 2*header["event_nr"]*np.dtype(EVENT_DTYPE).itemsize, 64)
+    quant_arr = np.zeros(data.chan_nr if sample_dtype in QUANTIZED_DTYPE_LIST else 0, dtype=_EPD_CACHE_QUANT_DTYPE)
+    samp_offset = _align(quant_offset + quant_arr.nbytes, _EPD_CACHE_ALIGN)
+    src_chan_nbytes = data.samp_nr*np.dtype(SAMPLE_DTYPE).itemsize
+    chan_nbytes = data.samp_nr*np.dtype(sample_dtype).itemsize
+
+    tmp_file_path = f"{cache_file_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file_path, "wb") as cache_file:
+            cache_file.write(_EPD_CACHE_PREAMBLE.pack(EPD_CACHE_MAGIC, EPD_CACHE_VERSION, 0, len(header_bytes), event_offset, samp_offset))
+            cache_file.write(header_bytes)
+            cache_file.seek(event_offset)
+            cache_file.write(np.ascontiguousarray(data.event_time_arr, dtype=EVENT_DTYPE).tobytes())
+            cache_file.write(np.ascontiguousarray(data.event_code_arr, dtype=EVENT_DTYPE).tobytes())
+            for i, chan_fname in enumerate(data.info_dict["chan_fnames"]):
+                cache_file.seek(samp_offset + i*chan_nbytes)
+                with open(os.path.join(data.info_dict["epd_dir"], chan_fname), "rb") as chan_file:
+                    if os.fstat(chan_file.fileno()).st_size != src_chan_nbytes:
+                        raise ValueError(f"Size of {chan_fname} does not match the number of samples")
+                    if len(quant_arr) > 0:
+                        quant_row, quant_arr["scale"][i], quant_arr["offset"][i], quant_arr["max_abs_error"][i] = quantize_row(np.fromfile(chan_file, dtype=SAMPLE_DTYPE), sample_dtype)
+                        cache_file.write(quant_row.astype(np.dtype(sample_dtype).newbyteorder("<"), copy=False).tobytes())
+                    else:
+                        shutil.copyfileobj(chan_file, cache_file)
+                    record_bytes_read(src_chan_nbytes)
+            cache_file.seek(quant_offset)
+            cache_file.write(quant_arr.tobytes())
+            cache_file.truncate(samp_offset + data.chan_nr*chan_nbytes)
+        os.replace(tmp_file_path, cache_file_path)
+    except:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        raise ValueError(f"Unable to create EPD cache {cache_file_path}")
+    return cache_file_path
+
+def is_epd_cache_valid(epd_file_path:str, cache_file_path:str=None, sample_dtype:str=None) -> bool:
+    """ Check whether a cache file exists and matches (by size & modification time) the files of the .epd recording.
+
+    Args:
+        epd_file_path: path to .epd file
+        cache_file_path: path of the cache file. Defaults to None, in which case `get_epd_cache_path` is used.
+        sample_dtype: required storage type of the samples (see `save_epd_cache`). Defaults to None (any).
+
+    Returns:
+        True if the cache can be used instead of the .epd recording
+    """
+    cache_file_path = get_epd_cache_path(epd_file_path) if cache_file_path is None else cache_file_path
+    try:
+        header = _read_epd_cache_header(cache_file_path)
+        if sample_dtype is not None and np.dtype(header["sample_dtype"]) != np.dtype(sample_dtype):
+            return False
+        return header["source_list"] == _epd_source_stamp_list(epd_file_path, header["info_dict"])
+    except (OSError, ValueError, KeyError):
+        return False
+
+@instrumented()
+def load_epd_cache(data:BrainData, cache_file_path:str, mode:str="mmap", chan_names:list=None, epd_file_path:str=None) -> dict:
+    """ Load a recording from its cache file (see `save_epd_cache`).
+
+    Args:
+        data: `braindynamics_plus.BrainData` instance used for storing brain activity recording
+        cache_file_path: path of the cache file
+        mode: "mmap" memory-maps the sample block (read-only), "memory" reads it into memory. Compact caches are wrapped in `QuantizedSamples` (dequantized on indexing). Defaults to "mmap".
+        chan_names: names (or indices) of the channels to keep, in the given order (memory-mapped subsets are stored as a `ChannelStack`). Defaults to None (all channels).
+        epd_file_path: path to the .epd file the cache belongs to, sets the directory of the channel binaries (`info_dict["epd_dir"]`). Defaults to None, in which case the directory of the cache file is used.
+
+    Returns:
+        read statistics of the samples, see `load_epd_samples`
+
+    Raises:
+        ValueError: invalid cache file; unknown loading mode; unknown channel
+    """
+    if mode not in ("memory", "mmap"):
+        raise ValueError(f"Unknown sample loading mode: {mode}")
+
+    start = time.perf_counter()
+    header = _read_epd_cache_header(cache_file_path)
+    data.clear()
+    data.chan_nr = header["chan_nr"]
+    data.samp_nr = header["samp_nr"]
+    data.samp_freq = header["samp_freq"]
+    data.info_dict.update(header["info_dict"])
+    data.info_dict["epd_dir"] = os.path.dirname(cache_file_path if epd_file_path is None else epd_file_path) # the directory stored in the header may be outdated
+    chan_idx_arr = None if chan_names is None else _select_channels(data, chan_names)
+    try:
+        data.event_time_arr = np.fromfile(cache_file_path, dtype=EVENT_DTYPE, count=header["event_nr"], offset=header["event_offset"])
+        data.event_code_arr = np.fromfile(cache_file_path, dtype=EVENT_DTYPE, count=header["event_nr"], offset=header["event_offset"] + header["event_nr"]*np.dtype(EVENT_DTYPE).itemsize)
+        data.event_nr = len(data.event_time_arr)
+        samp_dtype = np.dtype(header["sample_dtype"])
+        if mode == "mmap":
+            data.samp_mat = np.memmap(cache_file_path, dtype=samp_dtype, mode="r", offset=header["samp_offset"], shape=(header["chan_nr"], data.samp_nr))
+            if chan_idx_arr is not None: # rows of the memory-map, so only the picked channels are paged in
+                data.samp_mat = ChannelStack([data.samp_mat[chan_idx] for chan_idx in chan_idx_arr], dtype=samp_dtype)
+            byte_nr = 0
+        elif chan_idx_arr is None:
+            data.samp_mat = np.fromfile(cache_file_path, dtype=samp_dtype, count=data.chan_nr*data.samp_nr, offset=header["samp_offset"]).reshape(data.chan_nr, data.samp_nr)
+            byte_nr = data.samp_mat.nbytes
+            record_allocation(data.samp_mat)
+        else:
+            data.samp_mat = np.empty((data.chan_nr, data.samp_nr), dtype=samp_dtype)
+            for i, chan_idx in enumerate(chan_idx_arr):
+                data.samp_mat[i] = np.fromfile(cache_file_path, dtype=samp_dtype, count=data.samp_nr, offset=header["samp_offset"] + int(chan_idx)*data.samp_nr*samp_dtype.itemsize)
+            byte_nr = data.samp_mat.nbytes
+            record_allocation(data.samp_mat)
+        if samp_dtype != SAMPLE_DTYPE:
+            quant_arr = np.fromfile(cache_file_path, dtype=_EPD_CACHE_QUANT_DTYPE, count=header["chan_nr"], offset=header["quant_offset"])
+            quant_arr = quant_arr if chan_idx_arr is None else quant_arr[chan_idx_arr]
+            data.samp_mat = QuantizedSamples(data.samp_mat, quant_arr["scale"], quant_arr["offset"], quant_arr["max_abs_error"], dtype=SAMPLE_DTYPE)
+            byte_nr += quant_arr.nbytes
+    except:
+        raise ValueError(f"Unable to load data from EPD cache {cache_file_path}")
+    record_bytes_read(byte_nr + data.event_time_arr.nbytes + data.event_code_arr.nbytes)
+    record_allocation(data.event_time_arr, data.event_code_arr)
+    seconds = time.perf_counter() - start
+    return {"mode": mode, "workers": 1, "file_list": [], "bytes": byte_nr, "seconds": seconds, "throughput_mbps": byte_nr/seconds/1.0e6 if seconds > 0 else float("inf"), "cache_file_path": cache_file_path}
+
+@instrumented()
+def load_epd(data:BrainData, epd_file_path:str, mode:str="memory", workers:int=1, use_cache:bool=True, build_cache:bool=False, cache_dtype:str="float32", chan_names:list=None) -> dict:
+    """ Loading .epd header and data (samples) as well.
+
+    Args:
+        data: `braindynamics_plus.BrainData` instance used for storing brain activity recording
+        epd_file_path: path to .epd file
+        mode: sample loading mode, see `load_epd_samples`. Defaults to "memory".
+        workers: number of threads reading channel binaries, see `load_epd_samples`. Defaults to 1.
+        use_cache: load from the cache file (see `save_epd_cache`) if it exists, is up-to-date and stores the samples as `cache_dtype` (not in "pread" mode, which reads the channel binaries). Defaults to True.
+        build_cache: create (or refresh) the cache file if it is missing, outdated or of another storage type than `cache_dtype`. Defaults to False.
+        cache_dtype: storage type of the samples in the cache, see `save_epd_cache`. Compact caches are only used if requested explicitly. Defaults to "float32".
+        chan_names: names (or indices) of the channels to load, in the given order (only their binaries are read). Defaults to None (all channels).
+
+    Returns:
+        read statistics of the samples, see `load_epd_samples`
+    """
+    if mode != "pread" and (use_cache or build_cache):
+        cache_file_path = get_epd_cache_path(epd_file_path)
+        if is_epd_cache_valid(epd_file_path, cache_file_path, sample_dtype=cache_dtype):
+            return load_epd_cache(data, cache_file_path, mode=mode, chan_names=chan_names, epd_file_path=epd_file_path)
+        if build_cache:
+            save_epd_cache(epd_file_path, cache_file_path, sample_dtype=cache_dtype)
+            return load_epd_cache(data, cache_file_path, mode=mode, chan_names=chan_names, epd_file_path=epd_file_path)
+
+    load_epd_header(data, epd_file_path, chan_names=chan_names)
+    return load_epd_samples(data, mode=mode, workers=workers)
@@ -0,0 +1,257 @@
+""" Parameter sweeps over subjects, trial definitions and SCA parameters.
+
+Every subject is loaded once into shared memory and divided into trials once per trial definition, then all (trial
+definition x SCA parameter) combinations are processed by a pool of worker processes attaching to it without copying
+(the segmentations are handed over through `BrainData.seed_trial_cache`). Subjects are admitted while their samples fit
+into the memory budget, and released as soon as all of their combinations are done.
+
+Usage: python -m braindynamics_plus.sweep </path/to/config/file.json> [--workers N] [--memory-budget-gb GB]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import braindynamics_starprotocol as bd
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+from .braindata import BrainData, SAMPLE_DTYPE
+from ._samples import QuantizedSamples, QUANTIZED_DTYPE_LIST, quantize_row
+from .io.epd import load_epd_header, _read_chan_file
+from .io.dataset import get_subject_epd_path, list_epd_subjects, _as_list
+
+def parse_sweep_config(config_dict:dict) -> dict:
+    """ Collect the sweep definition from a configuration dictionary.
+
+    The format extends the one of `example/config.json`: `DATASET.SUBJECTS` lists the subjects (defaults to every
+    directory of `DATASET.ROOT_DIR` containing `<subject>.epd`, see `list_epd_subjects`), `DATASET.TRIAL` may be a list
+    of trial definitions, `SCA.SCALE_SIZE_S` and `SCA.MAX_SHIFT_S` may be lists of values, and the optional `SWEEP` section sets `WORKERS`, `LOAD_WORKERS`, `MEMORY_BUDGET_GB` and `STORAGE_DTYPE` ("float32", or
+    "int16"/"float16" to hold twice as many subjects in shared memory, see `BrainData.quantize_samples`).
+
+    Args:
+        config_dict: configuration dictionary (e.g. loaded from .json file)
+
+    Returns:
+        dictionary of the sweep definition
+
+    Raises:
+        ValueError: missing entries in the configuration
+    """
+    try:
+        dataset_dict = config_dict["DATASET"]
+        root_dir = dataset_dict["ROOT_DIR"]
+        if "SUBJECTS" in dataset_dict:
+            subject_list = _as_list(dataset_dict["SUBJECTS"])
+        else:
+            subject_list = list_epd_subjects(root_dir)
+        trial_list = _as_list(dataset_dict["TRIAL"])
+        for trial in trial_list:
+            if "START_CODE" not in trial or "END_CODE" not in trial:
+                raise ValueError(f"Trial definition {trial} should have both START_CODE and END_CODE")
+        sweep_dict = config_dict.get("SWEEP", {})
+        memory_budget_gb = sweep_dict.get("MEMORY_BUDGET_GB")
+        storage_dtype = sweep_dict.get("STORAGE_DTYPE", "float32")
+        if storage_dtype != "float32" and storage_dtype not in QUANTIZED_DTYPE_LIST:
+            raise ValueError(f"Unknown sample storage type: {storage_dtype}")
+        return {
+            "output_root": config_dict["OUTPUT_ROOT"],
+            "root_dir": root_dir,
+            "subject_list": subject_list,
+            "trial_list": trial_list,
+            "scale_size_list": _as_list(config_dict["SCA"]["SCALE_SIZE_S"]),
+            "max_shift_list": _as_list(config_dict["SCA"]["MAX_SHIFT_S"]),
+            "workers": sweep_dict.get("WORKERS"),
+            "load_workers": sweep_dict.get("LOAD_WORKERS", 1),
+            "memory_budget": None if memory_budget_gb is None else int(memory_budget_gb*2**30),
+            "storage_dtype": storage_dtype,
+        }
+    except (KeyError, TypeError) as err:
+        raise ValueError(f"Invalid sweep configuration, missing entry: {err}")
+
+def extract_networks(data:BrainData, subject_name:str, trial:dict, scale_size_s:float, max_shift_s:float, output_root:str) -> str:
+    """ Default sweep job: extract networks of the given trials with one SCA parameter (same steps as `example/pipeline_example.py`).
+
+    Args:
+        data: recording of the subject (samples are shared, must not be modified)
+        subject_name: name of the subject
+        trial: trial definition with "NAME", "START_CODE" and "END_CODE" keys
+        scale_size_s: SCA scale size parameter in seconds
+        max_shift_s: SCA max shift size parameter in seconds
+        output_root: output root directory
+
+    Returns:
+        output directory of the networks & lags
+    """
+    trial_data = data.get_trial_brain_data(start_mark_list=_as_list(trial["START_CODE"]), end_mark_list=_as_list(trial["END_CODE"]))
+    corrgram = bd.CrossCorrelogram(int(max_shift_s*trial_data.samp_freq), scale_size=int(scale_size_s*trial_data.samp_freq))
+    output_dir = os.path.join(output_root, subject_name, trial.get("NAME", "trial"), f"scale_{scale_size_s}_shift_{max_shift_s}")
+    os.makedirs(os.path.join(output_dir, "networks"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "lags"), exist_ok=True)
+    networks = bd.NetworkData()
+    networks.extract(trial_data.samp_mat_list, corrgram,
+                     export_to_filelists=(os.path.join(output_dir, "networks", "networks.filelist"),
+                                          os.path.join(output_dir, "lags", "lags.filelist")))
+    return output_dir
+
+def _share_subject(epd_file_path:str, load_workers:int, storage_dtype:str="float32", trial_list:list[dict]=()) -> tuple:
+    # load a subject into a new shared memory block, return the block and what workers need to rebuild the BrainData
+    data = BrainData()
+    load_epd_header(data, epd_file_path)
+    trial_table_list = []
+    for trial in trial_list: # segment once per subject, not once per job
+        start_mark_list, end_mark_list = _as_list(trial["START_CODE"]), _as_list(trial["END_CODE"])
+        data.divide_into_trials(start_mark_list, end_mark_list)
+        trial_table_list.append((start_mark_list, end_mark_list, data.trial_table))
+    samp_nbytes = data.chan_nr*data.samp_nr*np.dtype(storage_dtype).itemsize
+    quant_arr = np.zeros((3, data.chan_nr if storage_dtype in QUANTIZED_DTYPE_LIST else 0)) # scale, offset & max. error of every channel
+    shm = shared_memory.SharedMemory(create=True, size=max(samp_nbytes, 1))
+    try:
+        samp_mat = np.ndarray((data.chan_nr, data.samp_nr), dtype=storage_dtype, buffer=shm.buf)
+
+        def _share_chan(chan_idx:int) -> None:
+            # channel binaries are read straight into their shared row (or one temporary row per thread if quantized)
+            chan_file_path = os.path.join(data.info_dict["epd_dir"], data.info_dict["chan_fnames"][chan_idx])
+            if quant_arr.shape[1] > 0:
+                samp_row = np.empty(data.samp_nr, dtype=SAMPLE_DTYPE)
+                _read_chan_file(chan_file_path, samp_row)
+                samp_mat[chan_idx], quant_arr[0, chan_idx], quant_arr[1, chan_idx], quant_arr[2, chan_idx] = quantize_row(samp_row, storage_dtype)
+            else:
+                _read_chan_file(chan_file_path, samp_mat[chan_idx])
+
+        with ThreadPoolExecutor(max_workers=load_workers) as executor:
+            list(executor.map(_share_chan, range(data.chan_nr)))
+        del samp_mat
+    except:
+        shm.close()
+        shm.unlink()
+        raise
+    subject_dict = {
+        "shm_name": shm.name,
+        "chan_nr": data.chan_nr,
+        "samp_nr": data.samp_nr,
+        "samp_freq": data.samp_freq,
+        "storage_dtype": storage_dtype,
+        "quant_arr": quant_arr,
+        "event_time_arr": np.asarray(data.event_time_arr),
+        "event_code_arr": np.asarray(data.event_code_arr),
+        "info_dict": data.info_dict,
+        "trial_table_list": trial_table_list,
+    }
+    return shm, subject_dict
+
+def _run_job(job, subject_name:str, subject_dict:dict, trial:dict, scale_size_s:float, max_shift_s:float, output_root:str):
+    # executed in the worker processes: attach to the shared samples (zero-copy) and run the job
+    shm = shared_memory.SharedMemory(name=subject_dict["shm_name"])
+    data = BrainData()
+    try:
+        data.chan_nr = subject_dict["chan_nr"]
+        data.samp_nr = subject_dict["samp_nr"]
+        data.samp_freq = subject_dict["samp_freq"]
+        samp_mat = np.ndarray((data.chan_nr, data.samp_nr), dtype=subject_dict["storage_dtype"], buffer=shm.buf)
+        samp_mat.flags.writeable = False
+        if subject_dict["quant_arr"].shape[1] > 0:
+            scale_arr, offset_arr, max_abs_error_arr = subject_dict["quant_arr"]
+            samp_mat = QuantizedSamples(samp_mat, scale_arr, offset_arr, max_abs_error_arr, dtype=SAMPLE_DTYPE)
+        data.samp_mat = samp_mat
+        samp_mat = None
+        data.event_time_arr = subject_dict["event_time_arr"]
+        data.event_code_arr = subject_dict["event_code_arr"]
+        data.event_nr = len(data.event_time_arr)
+        data.info_dict.update(subject_dict["info_dict"])
+        for start_mark_list, end_mark_list, trial_table in subject_dict["trial_table_list"]:
+            data.seed_trial_cache(start_mark_list, end_mark_list, trial_table)
+        return job(data, subject_name, trial, scale_size_s, max_shift_s, output_root) # NOTE: result must not reference the shared samples
+    finally:
+        data = None
+        shm.close()
+
+def run_sweep(config_dict:dict, job=extract_networks, workers:int=None, memory_budget:int=None) -> list[dict]:
+    """ Run a job for every subject x trial definition x SCA parameter combination of the configuration.
+
+    Args:
+        config_dict: configuration dictionary, see `parse_sweep_config`
+        job: picklable function called as `job(data, subject_name, trial, scale_size_s, max_shift_s, output_root)` in the worker processes. Defaults to `extract_networks`.
+        workers: number of worker processes. Defaults to None, in which case the configuration (or the CPU count) decides.
+        memory_budget: maximal number of bytes of samples held in shared memory at once (a subject exceeding it alone is still processed alone). Defaults to None, in which case the configuration decides (no limit if not set).
+
+    Returns:
+        list of dictionaries, one per combination, with the job's result (or the error message if it failed)
+    """
+    sweep = parse_sweep_config(config_dict)
+    workers = workers if workers is not None else sweep["workers"]
+    memory_budget = memory_budget if memory_budget is not None else sweep["memory_budget"]
+    combination_list = list(itertools.product(sweep["trial_list"], sweep["scale_size_list"], sweep["max_shift_list"]))
+    if not combination_list:
+        return []
+
+    pending_subject_queue = deque(sweep["subject_list"])
+    resident_dict = {} # subject name -> [shared memory block, sample bytes, number of unfinished combinations]
+    future_dict = {} # future -> (job index, subject name, trial, scale size, max shift)
+    result_list = []
+
+    def _samp_nbytes(subject_name:str) -> int:
+        header = BrainData()
+        load_epd_header(header, get_subject_epd_path(sweep["root_dir"], subject_name))
+        return header.chan_nr*header.samp_nr*np.dtype(sweep["storage_dtype"]).itemsize
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            next_nbytes = None
+            while pending_subject_queue or future_dict:
+                while pending_subject_queue:
+                    subject_name = pending_subject_queue[0]
+                    if next_nbytes is None:
+                        next_nbytes = _samp_nbytes(subject_name)
+                    resident_nbytes = sum(resident[1] for resident in resident_dict.values())
+                    if resident_dict and memory_budget is not None and resident_nbytes + next_nbytes > memory_budget:
+                        break
+                    pending_subject_queue.popleft()
+                    shm, subject_dict = _share_subject(get_subject_epd_path(sweep["root_dir"], subject_name), sweep["load_workers"], sweep["storage_dtype"], sweep["trial_list"])
+                    resident_dict[subject_name] = [shm, next_nbytes, len(combination_list)]
+                    next_nbytes = None
+                    for trial, scale_size_s, max_shift_s in combination_list:
+                        future = executor.submit(_run_job, job, subject_name, subject_dict, trial, scale_size_s, max_shift_s, sweep["output_root"])
+                        future_dict[future] = (len(future_dict) + len(result_list), subject_name, trial, scale_size_s, max_shift_s)
+
+                done_set, _ = wait(future_dict, return_when=FIRST_COMPLETED)
+                for future in done_set:
+                    job_idx, subject_name, trial, scale_size_s, max_shift_s = future_dict.pop(future)
+                    result_dict = {"job_idx": job_idx, "subject": subject_name, "trial": trial.get("NAME"), "scale_size_s": scale_size_s, "max_shift_s": max_shift_s}
+                    try:
+                        result_dict["result"] = future.result()
+                    except Exception as err:
+                        result_dict["error"] = repr(err)
+                    result_list.append(result_dict)
+
+                    resident_dict[subject_name][2] -= 1
+                    if resident_dict[subject_name][2] == 0:
+                        shm = resident_dict.pop(subject_name)[0]
+                        shm.close()
+                        shm.unlink()
+    finally:
+        for shm, _, _ in resident_dict.values():
+            shm.close()
+            shm.unlink()
+
+    return sorted(result_list, key=lambda result_dict: result_dict["job_idx"])
+
+def main(argv:list[str]=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m braindynamics_plus.sweep", description="Run the BrainDynamics pipeline for every subject x trial x SCA parameter combination.")
+    parser.add_argument("config_file_path", help="path to a config file in .json format")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--memory-budget-gb", type=float, default=None, help="maximal size of samples held in shared memory (GB)")
+    args = parser.parse_args(argv)
+
+    with open(args.config_file_path, "r") as config_file:
+        config_dict = json.load(config_file)
+    memory_budget = None if args.memory_budget_gb is None else int(args.memory_budget_gb*2**30)
+    result_list = run_sweep(config_dict, workers=args.workers, memory_budget=memory_budget)
+    json.dump(result_list, sys.stdout, indent=4)
+    print()
+    if any("error" in result_dict for result_dict in result_list):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
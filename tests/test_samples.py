@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from braindynamics_plus._samples import ChannelStack, ChannelFileReader, QuantizedSamples
+
+CHAN_NR, SAMP_NR = 4, 37
+
+# indexing forms compared with the same indexing of a numpy array
+KEY_LIST = [
+    (slice(None), slice(None)),
+    (1, slice(None)),
+    (-1, slice(3, 20)),
+    (slice(1, 3), slice(5, 9)),
+    (slice(None), 7), # samples of every channel at a single time
+    (2, 7),
+    (slice(None), -1),
+    (slice(None), [0, 5, 2, 36]),
+    (slice(None), np.arange(SAMP_NR) % 3 == 0),
+    ([3, 0], slice(10, 12)),
+    (slice(None), slice(4, 4)),
+    (0, slice(None, None, 2)), # stepped slices
+    (slice(None), slice(1, 8, 3)),
+    (0, slice(None, None, -1)),
+    (slice(None, None, -2), slice(30, 2, -5)),
+]
+
+@pytest.fixture
+def samp_mat() -> np.ndarray:
+    return np.random.default_rng(0).standard_normal((CHAN_NR, SAMP_NR)).astype(np.float32)
+
+def _make_stack(samp_mat:np.ndarray, tmp_path) -> ChannelStack:
+    return ChannelStack([samp_mat[i] for i in range(CHAN_NR)])
+
+def _make_reader(samp_mat:np.ndarray, tmp_path) -> ChannelFileReader:
+    chan_file_path_list = []
+    for i in range(CHAN_NR):
+        chan_file_path_list.append(str(tmp_path / f"chan_{i}.bin"))
+        samp_mat[i].tofile(chan_file_path_list[-1])
+    return ChannelFileReader(chan_file_path_list, SAMP_NR)
+
+def _make_quantized(samp_mat:np.ndarray, tmp_path) -> QuantizedSamples:
+    return QuantizedSamples.quantize(samp_mat, "int16")
+
+@pytest.mark.parametrize("make", [_make_stack, _make_reader, _make_quantized])
+@pytest.mark.parametrize("key", KEY_LIST)
+def test_indexing(samp_mat, tmp_path, make, key):
+    stacked = make(samp_mat, tmp_path)
+    expected = np.asarray(samp_mat[key])
+    result = np.asarray(stacked[key])
+    assert result.shape == expected.shape
+    atol = stacked.max_abs_error_arr.max() + 1e-6 if isinstance(stacked, QuantizedSamples) else 0.0
+    np.testing.assert_allclose(result, expected, rtol=0.0, atol=atol)
+
+@pytest.mark.parametrize("make", [_make_stack, _make_reader, _make_quantized])
+def test_index_out_of_range(samp_mat, tmp_path, make):
+    stacked = make(samp_mat, tmp_path)
+    with pytest.raises(IndexError):
+        stacked[CHAN_NR, :]
+    with pytest.raises(IndexError):
+        stacked[:, [0, SAMP_NR]]
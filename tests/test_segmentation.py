@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from braindynamics_plus._segmentation import segment_trials
+
+def _reference_walk(event_time_arr:np.ndarray, event_code_arr:np.ndarray, start_mark_list:list[int], end_mark_list:list[int]) -> list:
+    """ Event-by-event division into trials, as done by `BrainData.divide_into_trials` before vectorization.
+
+    Returns:
+        list of (start time, end time, sorted list of unique (timestamp, code) markers) for every trial
+    """
+    time_list = [int(t) for t in event_time_arr]
+    code_list = [int(c) for c in event_code_arr]
+    event_nr = len(time_list)
+    trial_list = []
+    mark_set, first_time = set(), None # markers of the current trial, timestamp of its first marker
+
+    event_idx = 0
+    while event_idx < event_nr:
+        event_time, event_code = time_list[event_idx], code_list[event_idx]
+        if event_code in start_mark_list:
+            # restart the trial, also taking the preceding simultaneous events
+            mark_set, first_time = {(event_time, event_code)}, event_time
+            prev_event_idx = event_idx - 1
+            while prev_event_idx > -1 and time_list[prev_event_idx] == event_time:
+                mark_set.add((time_list[prev_event_idx], code_list[prev_event_idx]))
+                prev_event_idx -= 1
+        else:
+            if not mark_set:
+                first_time = event_time
+            mark_set.add((event_time, event_code))
+
+        if event_code in end_mark_list:
+            # close the trial, also taking the following simultaneous events
+            next_event_idx = event_idx + 1
+            while next_event_idx < event_nr and time_list[next_event_idx] == event_time:
+                mark_set.add((time_list[next_event_idx], code_list[next_event_idx]))
+                event_idx = next_event_idx
+                next_event_idx += 1
+            mark_time_list = [mark[0] for mark in mark_set]
+            trial_list.append((min(mark_time_list), max(max(mark_time_list), first_time + 1), sorted(mark_set)))
+            mark_set, first_time = set(), None
+
+        event_idx += 1
+    return trial_list
+
+def _segment(event_time_arr:np.ndarray, event_code_arr:np.ndarray, start_mark_list:list[int], end_mark_list:list[int]) -> list:
+    start_time_arr, end_time_arr, end_code_arr, mark_offset_arr, mark_time_arr, mark_code_arr = segment_trials(event_time_arr, event_code_arr, start_mark_list, end_mark_list)
+    assert len(start_time_arr) == len(end_time_arr) == len(end_code_arr) == len(mark_offset_arr) - 1
+    trial_list = []
+    for i in range(len(start_time_arr)):
+        mark_list = [(int(t), int(c)) for t, c in zip(mark_time_arr[mark_offset_arr[i]:mark_offset_arr[i + 1]], mark_code_arr[mark_offset_arr[i]:mark_offset_arr[i + 1]])]
+        assert int(end_code_arr[i]) in end_mark_list
+        trial_list.append((int(start_time_arr[i]), int(end_time_arr[i]), mark_list))
+    return trial_list
+
+def _check(event_time_list:list[int], event_code_list:list[int], start_mark_list:list[int], end_mark_list:list[int]) -> list:
+    event_time_arr = np.asarray(event_time_list, dtype=np.int32)
+    event_code_arr = np.asarray(event_code_list, dtype=np.int32)
+    trial_list = _segment(event_time_arr, event_code_arr, start_mark_list, end_mark_list)
+    assert trial_list == _reference_walk(event_time_arr, event_code_arr, start_mark_list, end_mark_list)
+    return trial_list
+
+def test_empty_timeline():
+    assert _check([], [], [1], [2]) == []
+    assert _check([], [], [], []) == []
+
+def test_no_start_codes():
+    # trials begin right after the previous one
+    trial_list = _check([0, 1, 2, 3, 4, 5], [5, 2, 6, 7, 2, 8], [1], [2])
+    assert trial_list == [(0, 1, [(0, 5), (1, 2)]), (2, 4, [(2, 6), (3, 7), (4, 2)])]
+    assert _check([0, 1, 2, 3], [5, 2, 6, 2], [], [2]) == trial_list[:1] + [(2, 3, [(2, 6), (3, 2)])]
+    assert _check([0, 1, 2], [5, 6, 7], [1], []) == []
+
+def test_code_both_start_and_end():
+    # every occurence of the code is a trial on its own (with its simultaneous events)
+    trial_list = _check([0, 1, 1, 2, 3], [5, 3, 4, 6, 3], [3], [3])
+    assert trial_list == [(1, 2, [(1, 3), (1, 4)]), (3, 4, [(3, 3)])]
+    _check([0, 0, 1, 2, 2, 4], [3, 1, 3, 2, 3, 3], [1, 3], [2, 3])
+
+def test_several_end_codes_at_one_timestamp():
+    # only the first end code of a group closes a trial, the group belongs to that trial
+    trial_list = _check([0, 2, 2, 2, 3, 4, 4], [1, 2, 9, 2, 1, 2, 2], [1], [2])
+    assert trial_list == [(0, 2, [(0, 1), (2, 2), (2, 9)]), (3, 4, [(3, 1), (4, 2)])]
+    _check([0, 1, 1, 1, 1], [1, 2, 3, 1, 2], [1], [2, 3])
+
+def test_duplicate_markers():
+    assert _check([0, 1, 1, 2], [1, 5, 5, 2], [1], [2]) == [(0, 2, [(0, 1), (1, 5), (2, 2)])]
+
+@pytest.mark.parametrize("seed", range(5))
+def test_randomized_timelines(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(500):
+        event_nr = int(rng.integers(0, 40))
+        event_time_arr = np.sort(rng.integers(0, 30, event_nr)).astype(np.int32)
+        if rng.random() < 0.2:
+            event_time_arr = rng.integers(0, 30, event_nr).astype(np.int32) # unsorted timeline
+        event_code_arr = rng.integers(0, 6, event_nr).astype(np.int32)
+        start_mark_list = [int(c) for c in rng.choice(6, int(rng.integers(0, 3)), replace=False)]
+        end_mark_list = [int(c) for c in rng.choice(6, int(rng.integers(0, 3)), replace=False)]
+        assert _segment(event_time_arr, event_code_arr, start_mark_list, end_mark_list) == _reference_walk(event_time_arr, event_code_arr, start_mark_list, end_mark_list), \
+            (event_time_arr.tolist(), event_code_arr.tolist(), start_mark_list, end_mark_list)
+
+def test_dimension_mismatch():
+    with pytest.raises(ValueError):
+        segment_trials(np.zeros(3, dtype=np.int32), np.zeros(2, dtype=np.int32), [1], [2])